@@ -3,10 +3,20 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import os
+import re
 import json
+import time
+import hashlib
 import asyncio
+import traceback
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+import aiohttp
 from dotenv import load_dotenv
 from keep_alive import keep_alive  # seu keep_alive.py separado
+from storage import Store, StoreBusy, ranking_key
+import metrics
 
 load_dotenv()
 
@@ -19,9 +29,71 @@ INTENTS = discord.Intents.default()
 INTENTS.message_content = True
 INTENTS.members = True
 
-bot = commands.Bot(command_prefix="!", intents=INTENTS)
+# Modo com shards: SHARD_COUNT é o total de shards e SHARD_IDS (ex.: "0,1")
+# os que este processo roda. Vários processos dividem o estado com
+# STORAGE_MODE=shared (mesmo SQLITE_PATH). Sem SHARD_COUNT roda um Bot comum.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(x) for x in os.getenv("SHARD_IDS", "").split(",") if x.strip()]
 
-DATA_FILE = "dados.json"
+class FilaBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    async def setup_hook(self):
+        restore_state()
+        await sync_commands()
+        self.flusher_task = asyncio.create_task(store.run_flusher())
+        self.ticket_tasks = [asyncio.create_task(ticket_worker()) for _ in range(TICKET_WORKERS)]
+        if TICKET_POOL_SIZE > 0:
+            self.pool_task = asyncio.create_task(ticket_pool.run())
+
+    async def close(self):
+        await super().close()
+        # para as tarefas de fundo antes do flush final: o flusher pode estar
+        # no meio de uma gravação e os dois escreveriam o mesmo arquivo
+        tasks = [getattr(self, "flusher_task", None), getattr(self, "pool_task", None),
+                 *getattr(self, "ticket_tasks", [])]
+        tasks = [t for t in tasks if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # garante que nada fique só na memória ao desligar
+        store.flush()
+
+# ========== REST METRICS ==========
+# Toda chamada HTTP do discord.py passa por esse trace do aiohttp; ids e
+# tokens são tirados da URL para a rota virar um label de baixa cardinalidade.
+_ROUTE_ID = re.compile(r"/\d{5,}")
+_ROUTE_TOKEN = re.compile(r"/[A-Za-z0-9_.-]{40,}")
+
+def rest_route(path: str) -> str:
+    path = path.split("/api/v", 1)[-1]
+    path = path[path.find("/"):] if "/" in path else path
+    return _ROUTE_TOKEN.sub("/:token", _ROUTE_ID.sub("/:id", path))
+
+async def _on_request_start(session, ctx, params):
+    ctx.start = time.perf_counter()
+
+async def _on_request_end(session, ctx, params):
+    route = rest_route(params.url.path)
+    metrics.REST_SECONDS.labels(params.method, route).observe(time.perf_counter() - ctx.start)
+    metrics.REST_CALLS.labels(params.method, route, str(params.response.status)).inc()
+
+async def _on_request_exception(session, ctx, params):
+    metrics.REST_CALLS.labels(params.method, rest_route(params.url.path), "error").inc()
+
+rest_trace = aiohttp.TraceConfig()
+rest_trace.on_request_start.append(_on_request_start)
+rest_trace.on_request_end.append(_on_request_end)
+rest_trace.on_request_exception.append(_on_request_exception)
+
+_shard_kwargs = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS or None} if SHARD_COUNT else {}
+bot = FilaBot(command_prefix="!", intents=INTENTS, http_trace=rest_trace, **_shard_kwargs)
+
+# DATA_FORMAT=compact (padrão) grava dados.fila no formato compacto do
+# storage.py; na primeira vez o dados.json (com o journal, se houver) é
+# migrado para ele. filas.json/db.json do bot antigo só pelo CLI
+# (python storage.py migrate), para não ressuscitar filas mortas.
+DATA_FORMAT = os.getenv("DATA_FORMAT", "compact")
+DATA_FILE = "dados.fila" if DATA_FORMAT == "compact" else "dados.json"
+LEGACY_FILES = ["dados.json"]
 ICON_URL = "https://cdn.discordapp.com/icons/1316463004618985522/c4766c485842022b18beda93d48dcd5b.png?size=2048"
 
 # Categories (conforme solicitado)
@@ -40,32 +112,243 @@ STUMBLE_MAPS = ["Block Dash", "Rush Hour", "Laser Tracer"]
 # Taxa fixa por AP (R$)
 TAXA_AP = 1.00
 
+# Rankings por período (dia/semana/mês) usam o fuso do servidor; padrão UTC-3 (Brasília)
+RANKING_TZ = timezone(timedelta(hours=float(os.getenv("RANKING_UTC_OFFSET", "-3"))))
+
+# Em quantas filas (somando todos os canais) um usuário pode estar ao mesmo tempo; 0 = sem limite
+MAX_QUEUES_PER_USER = int(os.getenv("MAX_QUEUES_PER_USER", "0"))
+
+# ========== LOCKS ==========
+# Um lock por fila (canal + mapa/modo) e um por canal para /criar, /criarvalorant
+# e /remover. Não existe lock global: ranking e demais mutações são ops
+# síncronos (sem await no meio), então não precisam de seção crítica.
+class LockRegistry:
+    def __init__(self):
+        self._locks = {}
+
+    def get(self, key: tuple) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def drop_channel(self, channel_id: str):
+        for key in [k for k in self._locks if k[0] == channel_id and not self._locks[k].locked()]:
+            del self._locks[key]
+
+locks = LockRegistry()
+
+class TimedLock:
+    """`async with` sobre um lock do registro, medindo espera e retenção."""
+    __slots__ = ("lock", "scope", "_t")
+
+    def __init__(self, lock: asyncio.Lock, scope: str):
+        self.lock = lock
+        self.scope = scope
+
+    async def __aenter__(self):
+        t = time.perf_counter()
+        await self.lock.acquire()
+        self._t = time.perf_counter()
+        metrics.LOCK_WAIT_SECONDS.labels(self.scope).observe(self._t - t)
+
+    async def __aexit__(self, *exc):
+        self.lock.release()
+        metrics.LOCK_HOLD_SECONDS.labels(self.scope).observe(time.perf_counter() - self._t)
+
+def queue_lock(channel_id: str, map_key: str) -> TimedLock:
+    return TimedLock(locks.get((channel_id, map_key)), "queue")
+
+def channel_lock(channel_id: str) -> TimedLock:
+    return TimedLock(locks.get((channel_id,)), "channel")
+
+# ========== REST SCHEDULER ==========
+# Toda chamada REST de saída passa por aqui. Pedidos esperam numa fila por
+# prioridade (respostas de interação > tickets > edições de painel > pins >
+# manutenção do pool) e cada rota tem um limite de chamadas simultâneas.
+# Respostas de interação não contam no limite global REST_MAX_INFLIGHT (o
+# Discord não aplica o rate limit global a elas), então nunca esperam atrás
+# de edições ou pins.
+# Um pedido com `key` substitui o pedido ainda na fila com a mesma key (ex.:
+# uma edição de painel mais nova torna a anterior obsoleta).
+PRIO_INTERACTION, PRIO_TICKET, PRIO_PANEL, PRIO_PIN, PRIO_POOL = range(5)
+PRIO_NAMES = ("interaction", "ticket", "panel", "pin", "pool")
+
+REST_MAX_INFLIGHT = int(os.getenv("REST_MAX_INFLIGHT", "16"))
+# limite de chamadas simultâneas por rota ("tipo:escopo"), pelo tipo; 0 = sem limite
+REST_ROUTE_LIMITS = {"interaction": 0, "ticket": 2, "panel": 1, "pin": 1, "pool": 1}
+
+class Superseded(Exception):
+    """O pedido saiu da fila porque um mais novo com a mesma key o substituiu."""
+
+class _RestRequest:
+    __slots__ = ("factory", "priority", "route", "key", "future", "queued_at")
+
+    def __init__(self, factory, priority: int, route: str, key, future: asyncio.Future):
+        self.factory = factory
+        self.priority = priority
+        self.route = route
+        self.key = key
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+class RestScheduler:
+    def __init__(self, max_inflight: int, route_limits: dict):
+        self.max_inflight = max_inflight
+        self.route_limits = route_limits
+        self._queues = [deque() for _ in PRIO_NAMES]
+        self._keys = {}  # key -> _RestRequest ainda na fila
+        self._inflight = 0
+        self._route_inflight = {}
+
+    def submit(self, factory, priority: int, route: str, key=None) -> asyncio.Future:
+        """Enfileira `factory()` (uma função que devolve a coroutine da chamada) e devolve um Future."""
+        req = _RestRequest(factory, priority, route, key, asyncio.get_running_loop().create_future())
+        if key is not None:
+            old = self._keys.get(key)
+            if old is not None and not old.future.done():
+                old.future.set_exception(Superseded(key))
+                metrics.REST_SUPERSEDED.labels(PRIO_NAMES[old.priority]).inc()
+            self._keys[key] = req
+        self._queues[priority].append(req)
+        metrics.REST_QUEUED.labels(PRIO_NAMES[priority]).inc()
+        self._pump()
+        return req.future
+
+    async def call(self, factory, priority: int, route: str, key=None):
+        return await self.submit(factory, priority, route, key)
+
+    def fire(self, factory, priority: int, route: str, key=None) -> asyncio.Future:
+        """submit sem ninguém esperando: falhas só vão para o log."""
+        fut = self.submit(factory, priority, route, key)
+        fut.add_done_callback(_log_rest_failure)
+        return fut
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues)
+
+    def _route_free(self, route: str) -> bool:
+        limit = self.route_limits.get(route.split(":", 1)[0], 1)
+        return not limit or self._route_inflight.get(route, 0) < limit
+
+    def _pump(self):
+        for priority, q in enumerate(self._queues):
+            i = 0
+            while i < len(q) and (priority == PRIO_INTERACTION or self._inflight < self.max_inflight):
+                req = q[i]
+                if req.future.done():
+                    # substituído ou cancelado por quem esperava
+                    del q[i]
+                    metrics.REST_QUEUED.labels(PRIO_NAMES[priority]).dec()
+                    continue
+                if not self._route_free(req.route):
+                    i += 1
+                    continue
+                del q[i]
+                metrics.REST_QUEUED.labels(PRIO_NAMES[priority]).dec()
+                self._start(req)
+
+    def _start(self, req: _RestRequest):
+        if req.key is not None and self._keys.get(req.key) is req:
+            del self._keys[req.key]  # já saiu, não pode mais ser substituído
+        if req.priority != PRIO_INTERACTION:
+            self._inflight += 1
+        self._route_inflight[req.route] = self._route_inflight.get(req.route, 0) + 1
+        metrics.REST_QUEUE_SECONDS.labels(PRIO_NAMES[req.priority]).observe(time.perf_counter() - req.queued_at)
+        asyncio.create_task(self._run(req))
+
+    async def _run(self, req: _RestRequest):
+        try:
+            result = await req.factory()
+        except Exception as e:
+            if not req.future.done():
+                req.future.set_exception(e)
+        else:
+            if not req.future.done():
+                req.future.set_result(result)
+        finally:
+            if req.priority != PRIO_INTERACTION:
+                self._inflight -= 1
+            n = self._route_inflight[req.route] - 1
+            if n:
+                self._route_inflight[req.route] = n
+            else:
+                del self._route_inflight[req.route]
+            self._pump()
+
+def _log_rest_failure(fut: asyncio.Future):
+    if fut.cancelled():
+        return
+    exc = fut.exception()
+    if exc is not None and not isinstance(exc, (Superseded, discord.NotFound)):
+        print("Erro em chamada REST em background:", exc)
+
+rest = RestScheduler(REST_MAX_INFLIGHT, REST_ROUTE_LIMITS)
+
+async def respond(interaction: discord.Interaction, *args, **kwargs):
+    """Resposta inicial a uma interação, com prioridade máxima no agendador."""
+    await rest.call(partial(interaction.response.send_message, *args, **kwargs), PRIO_INTERACTION, "interaction")
+
 # ========== DATA IO ==========
-data_lock = asyncio.Lock()
-
-def _ensure_file():
-    if not os.path.exists(DATA_FILE):
-        base = {
-            "filas": {},  # keyed by channel_id -> dict of queues per map/mode
-            "ranking_stumble": {},
-            "ranking_valorant": {}
-        }
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(base, f, indent=4, ensure_ascii=False)
+# estado carregado uma vez; o disco é atualizado em background (write-behind)
+# STORAGE_MODE=journal grava cada mutação num journal append-only
+# STORAGE_MODE=sqlite usa o banco SQLITE_PATH (importa dados.json na primeira vez)
+STORAGE_MODE = os.getenv("STORAGE_MODE", "json")
+if SHARD_IDS and len(SHARD_IDS) < SHARD_COUNT and STORAGE_MODE != "shared":
+    raise RuntimeError("SHARD_IDS com só parte dos shards exige STORAGE_MODE=shared")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "dados.db")
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2.0"))
+# STORAGE_MODE=shared: quanto esperar pelo lock de escrita de outro processo
+# antes de desistir e pedir para o usuário tentar de novo
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "0.5"))
+FLUSH_BATCH = int(os.getenv("FLUSH_BATCH", "50"))
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") == "1"
+store = Store(DATA_FILE, mode=STORAGE_MODE, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH,
+              compact_every=JOURNAL_COMPACT_EVERY, fsync=JOURNAL_FSYNC, db_path=SQLITE_PATH,
+              fmt=DATA_FORMAT, legacy=[p for p in LEGACY_FILES if p != DATA_FILE], busy_timeout=SQLITE_BUSY_TIMEOUT)
+store.load()
 
 def read_data():
-    _ensure_file()
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Retorna o estado em memória (não toca no disco)."""
+    return store.data
 
-def write_data(d):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=4, ensure_ascii=False)
+def commit(op: dict):
+    """Aplica uma mutação (ver storage.OPS) e agenda a persistência."""
+    store.commit(op)
 
 # ========== HELPERS ==========
 def key_from_name(name: str) -> str:
     return name.lower().replace(" ", "_").replace("x", "x")
 
+def track_depth(channel_id: str, map_key: str):
+    fila = read_data()["filas"].get(channel_id)
+    q = fila["queues"].get(map_key) if fila else None
+    if q is None:
+        metrics.QUEUE_DEPTH.remove(channel_id, map_key)
+    else:
+        metrics.QUEUE_DEPTH.labels(channel_id, map_key).set(len(q["inscritos"]))
+
+PERIODOS = {"dia": "d", "semana": "w", "mes": "m", "mês": "m"}
+
+def period_buckets(ts: float = None) -> list:
+    """Buckets de rollup do instante `ts`: dia, semana ISO, mês e o acumulado ("all")."""
+    t = datetime.fromtimestamp(ts if ts is not None else time.time(), RANKING_TZ)
+    year, week, _ = t.isocalendar()
+    return [f"d:{t:%Y-%m-%d}", f"w:{year}-W{week:02d}", f"m:{t:%Y-%m}", "all"]
+
+def current_bucket(periodo: str):
+    """Bucket atual do período ("dia", "semana", "mes"), ou None para o ranking geral."""
+    kind = PERIODOS.get(periodo)
+    if kind is None:
+        return None
+    return next(b for b in period_buckets() if b.startswith(kind + ":"))
+
+def queue_label(channel_id: str, map_key: str) -> str:
+    fila = read_data()["filas"].get(channel_id)
+    q = fila["queues"].get(map_key) if fila else None
+    return q["label"] if q else map_key
+
 def make_queue_embed_single(jogo: str, fila_record: dict, map_key: str):
     """Embed para uma fila específica (map/mode)"""
     mapa_label = fila_record["queues"][map_key]["label"]
@@ -92,8 +375,7 @@ def make_queue_embed_single(jogo: str, fila_record: dict, map_key: str):
     emb.set_footer(text="ZN Revelation • Apostas automáticas")
     return emb
 
-async def pin_unpin_prev(channel: discord.TextChannel, new_msg: discord.Message, fila_record: dict):
-    prev = fila_record.get("message_id")
+async def _repin(channel: discord.TextChannel, new_msg: discord.Message, prev):
     if prev:
         try:
             prev_msg = await channel.fetch_message(prev)
@@ -106,17 +388,14 @@ async def pin_unpin_prev(channel: discord.TextChannel, new_msg: discord.Message,
     except Exception:
         pass
 
-def ensure_channel_fila_structure(d: dict, channel_id: str):
-    """Garante que exista estrutura para esse canal em dados"""
-    if "filas" not in d:
-        d["filas"] = {}
-    if channel_id not in d["filas"]:
-        d["filas"][channel_id] = {
-            "jogo": "stumble",  # default until set by command
-            "valor": 1.0,
-            "rodadas": 1,
-            "queues": {},  # map_key -> { label, inscritos:list, max_pessoas:int, message_id }
-        }
+async def _unpin(channel: discord.TextChannel, mid):
+    msg = await channel.fetch_message(mid)
+    if msg.pinned:
+        await msg.unpin()
+
+def pin_unpin_prev(channel: discord.TextChannel, new_msg: discord.Message, fila_record: dict):
+    # pins são cosméticos: vão para o fim da fila do agendador, sem ninguém esperando
+    rest.fire(partial(_repin, channel, new_msg, fila_record.get("message_id")), PRIO_PIN, f"pin:{channel.id}")
 
 # ========== VIEWS & COMPONENTS ==========
 class MapButtonsView(discord.ui.View):
@@ -127,8 +406,8 @@ class MapButtonsView(discord.ui.View):
 
         # add map buttons dynamically according to stored queues for this channel
         d = read_data()
-        ensure_channel_fila_structure(d, channel_id)
-        queues = d["filas"][channel_id]["queues"]
+        fila = d["filas"].get(channel_id)
+        queues = fila["queues"] if fila else {}
         for map_key, info in queues.items():
             # create a button per map (label visible)
             btn = discord.ui.Button(label=info["label"], style=discord.ButtonStyle.primary, custom_id=f"mapbtn|{channel_id}|{map_key}")
@@ -143,261 +422,690 @@ class MapButtonsView(discord.ui.View):
     # Since buttons were added dynamically, we listen to on_interaction using a global handler below
     # (discord.py doesn't let dynamic callbacks be set easily here)
 
-# We'll register a global interaction handler for custom_id patterns:
-@bot.event
-async def on_interaction(interaction: discord.Interaction):
-    # handle button custom_id patterns:
-    if not interaction.type == discord.InteractionType.component:
-        return
+# ========== PANEL CACHES ==========
+# Handles de mensagem (PartialMessage, sem GET) por message_id e views já
+# montadas por canal. As views só mudam quando /criar, /criarvalorant ou
+# /remover mexem no layout das filas, e é aí que o cache é invalidado.
+_message_cache = {}  # message_id -> discord.PartialMessage
+_view_cache = {}     # channel_id -> MapButtonsView
 
-    cid = interaction.channel.id
-    uid = str(interaction.user.id)
-    custom_id = interaction.data.get("custom_id", "")
-    # patterns:
-    # mapbtn|<channel_id>|<map_key>
-    # verfilas|<channel_id>
-    # join|<channel_id>|<map_key>
-    # leave|<channel_id>|<map_key>
-    try:
-        parts = custom_id.split("|")
-        if parts[0] == "mapbtn" and parts[1] == str(cid):
-            # user pressed the map button: show the queue embed and temporary join/leave buttons
-            channel_id = parts[1]
-            map_key = parts[2]
-            d = read_data()
-            fila = d["filas"].get(channel_id)
-            if not fila:
-                await interaction.response.send_message("⚠️ Esta fila não existe mais.", ephemeral=True)
-                return
-            # create a view with Join/Leave/Ver buttons specific to this map
-            view = discord.ui.View(timeout=None)
-            join_btn = discord.ui.Button(label="Entrar", style=discord.ButtonStyle.success, custom_id=f"join|{channel_id}|{map_key}")
-            leave_btn = discord.ui.Button(label="Sair", style=discord.ButtonStyle.danger, custom_id=f"leave|{channel_id}|{map_key}")
-            ver_btn = discord.ui.Button(label="Ver jogadores", style=discord.ButtonStyle.secondary, custom_id=f"ver|{channel_id}|{map_key}")
-            view.add_item(join_btn)
-            view.add_item(leave_btn)
-            view.add_item(ver_btn)
-            embed = make_queue_embed_single(fila["jogo"], fila, map_key)
-            await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+def panel_message(channel_id: str, mid: int):
+    m = _message_cache.get(mid)
+    if m is None:
+        ch = bot.get_channel(int(channel_id))
+        if not ch:
+            return None
+        m = _message_cache[mid] = ch.get_partial_message(mid)
+    return m
+
+def panel_view(channel_id: str, jogo: str) -> MapButtonsView:
+    view = _view_cache.get(channel_id)
+    if view is None or view.jogo != jogo:
+        view = _view_cache[channel_id] = MapButtonsView(channel_id, jogo)
+    return view
+
+def invalidate_panel_cache(channel_id: str, mid=None):
+    _view_cache.pop(channel_id, None)
+    if mid:
+        _message_cache.pop(mid, None)
+
+# ========== PANEL EDITS ==========
+# Edições do painel fixado são agrupadas por mensagem: vários joins/leaves
+# dentro de PANEL_EDIT_DELAY viram uma única edição com o estado mais novo,
+# e a edição é pulada se o conteúdo renderizado não mudou.
+PANEL_EDIT_DELAY = float(os.getenv("PANEL_EDIT_DELAY", "1.0"))
+
+class PanelEditor:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending = {}  # message_id -> (channel_id, map_key) mais recente
+        self._tasks = {}    # message_id -> task de edição em andamento
+        self._last = {}     # message_id -> assinatura do último conteúdo enviado
+
+    def schedule(self, channel_id: str, map_key: str):
+        fila = read_data()["filas"].get(channel_id)
+        mid = fila.get("message_id") if fila else None
+        if not mid:
             return
+        self._pending[mid] = (channel_id, map_key)
+        if mid not in self._tasks:
+            self._tasks[mid] = asyncio.create_task(self._run(mid))
 
-        if parts[0] == "join":
-            channel_id = parts[1]
-            map_key = parts[2]
-            async with data_lock:
-                d = read_data()
-                fila = d["filas"].get(channel_id)
-                if not fila:
-                    await interaction.response.send_message("⚠️ Fila inexistente.", ephemeral=True)
-                    return
-                queue = fila["queues"].get(map_key)
-                if not queue:
-                    await interaction.response.send_message("⚠️ Fila desse mapa não existe.", ephemeral=True)
-                    return
-                if uid in queue["inscritos"]:
-                    await interaction.response.send_message("⚠️ Você já está nessa fila.", ephemeral=True)
-                    return
-                if len(queue["inscritos"]) >= queue["max_pessoas"]:
-                    await interaction.response.send_message("❌ Essa fila já está cheia.", ephemeral=True)
-                    return
-                queue["inscritos"].append(uid)
-                # update ranking
-                if fila["jogo"] == "stumble":
-                    rk = d.setdefault("ranking_stumble", {})
-                    rk[uid] = rk.get(uid, 0) + 1
-                else:
-                    rk = d.setdefault("ranking_valorant", {})
-                    rk[uid] = rk.get(uid, 0) + 1
-                write_data(d)
-
-            # update pinned message if exists
-            try:
-                ch = bot.get_channel(int(channel_id))
-                mid = fila.get("message_id")
-                if ch and mid:
-                    try:
-                        m = await ch.fetch_message(mid)
-                        await m.edit(embed=make_queue_embed_single(fila["jogo"], fila, map_key), view=MapButtonsView(channel_id, fila["jogo"]))
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-
-            await interaction.response.send_message(f"✅ Você entrou na fila **{fila['queues'][map_key]['label']}**!", ephemeral=True)
-
-            # If reached capacity -> create ticket
-            # Re-read to ensure up-to-date
-            async with data_lock:
-                d2 = read_data()
-                fila2 = d2["filas"].get(channel_id)
-                queue2 = fila2["queues"].get(map_key)
-                if len(queue2["inscritos"]) >= queue2["max_pessoas"]:
-                    # create ticket channel in appropriate category
-                    guild = interaction.guild
-                    if fila2["jogo"] == "stumble":
-                        categoria = discord.utils.get(guild.categories, id=CATEGORIA_STUMBLE)
-                    else:
-                        categoria = discord.utils.get(guild.categories, id=CATEGORIA_VALORANT)
-                    chan_name = f"🎫-{queue2['label'].lower().replace(' ', '')}-apostado"
-                    try:
-                        new_chan = await guild.create_text_channel(name=chan_name, category=categoria)
-                    except Exception:
-                        # fallback to default category
-                        new_chan = await guild.create_text_channel(name=chan_name)
-                    # ping users
-                    users = [guild.get_member(int(x)) for x in queue2["inscritos"]]
-                    mentions = " ".join(u.mention for u in users if u)
-                    total_value = queue2["max_pessoas"] * fila2["valor"]
-                    taxa_total = queue2["max_pessoas"] * TAXA_AP
-                    # announcement + embed
-                    await new_chan.send(f"🎮 {mentions} — o confronto foi criado! Enviem o **comprovante do Pix** aqui.")
-                    emb = discord.Embed(
-                        title=f"🎟️ Ticket • {queue2['label']}",
-                        description=(
-                            f"💸 **Valor por pessoa:** R$ {fila2['valor']:.2f}\n"
-                            f"💰 **Total (sem taxa):** R$ {total_value:.2f}\n"
-                            f"💸 **Taxa total (R$ {TAXA_AP:.2f} por AP):** R$ {taxa_total:.2f}\n\n"
-                            f"🔑 **Chave Pix:** `https://tipa.ai/duckioo23`\n\n"
-                            f"⚠️ Enviem o comprovante **neste canal** para começar a partida."
-                        ),
-                        color=discord.Color.dark_red()
-                    )
-                    emb.set_thumbnail(url=ICON_URL)
-                    await new_chan.send(embed=emb)
-                    # reset this queue
-                    queue2["inscritos"] = []
-                    fila2["rodadas"] = fila2.get("rodadas", 1) + 1
-                    write_data(d2)
-                    # update pinned message in original channel
-                    try:
-                        if fila2.get("message_id"):
-                            och = bot.get_channel(int(channel_id))
-                            if och:
-                                om = await och.fetch_message(fila2.get("message_id"))
-                                await om.edit(embed=make_queue_embed_single(fila2["jogo"], fila2, map_key), view=MapButtonsView(channel_id, fila2["jogo"]))
-                    except Exception:
-                        pass
-                    # notify the user who triggered
-                    try:
-                        await interaction.followup.send("✅ Fila completa! Ticket criado e fila reiniciada.", ephemeral=True)
-                    except Exception:
-                        pass
+    def forget(self, mid):
+        self._pending.pop(mid, None)
+        self._last.pop(mid, None)
+
+    async def _run(self, mid):
+        try:
+            # enquanto chegarem atualizações durante a espera/edição, repete
+            while mid in self._pending:
+                await asyncio.sleep(self.delay)
+                item = self._pending.pop(mid, None)
+                if item is None:
+                    continue  # painel removido durante a espera
+                channel_id, map_key = item
+                fila = read_data()["filas"].get(channel_id)
+                if not fila or fila.get("message_id") != mid or map_key not in fila["queues"]:
+                    continue
+                embed = make_queue_embed_single(fila["jogo"], fila, map_key)
+                view = panel_view(channel_id, fila["jogo"])
+                sig = (json.dumps(embed.to_dict(), sort_keys=True), tuple(item.custom_id for item in view.children))
+                if self._last.get(mid) == sig:
+                    continue
+                m = panel_message(channel_id, mid)
+                if m is None:
+                    continue
+                # não espera a edição: se ela ainda estiver na fila do agendador
+                # quando vier a próxima, a próxima a substitui
+                self._last[mid] = sig
+                fut = rest.submit(partial(m.edit, embed=embed, view=view), PRIO_PANEL,
+                                  f"panel:{channel_id}", key=("panel", mid))
+                fut.add_done_callback(partial(self._edited, channel_id, mid, sig))
+        finally:
+            self._tasks.pop(mid, None)
+
+    def _edited(self, channel_id: str, mid, sig, fut: asyncio.Future):
+        exc = None if fut.cancelled() else fut.exception()
+        if exc is None and not fut.cancelled():
             return
+        # não foi ao ar: a próxima edição com esse conteúdo não pode ser pulada
+        if self._last.get(mid) == sig:
+            del self._last[mid]
+        if isinstance(exc, discord.NotFound):
+            invalidate_panel_cache(channel_id, mid)
+
+panels = PanelEditor(PANEL_EDIT_DELAY)
 
-        if parts[0] == "leave":
-            channel_id = parts[1]
-            map_key = parts[2]
-            async with data_lock:
-                d = read_data()
-                fila = d["filas"].get(channel_id)
-                if not fila:
-                    await interaction.response.send_message("⚠️ Fila inexistente.", ephemeral=True)
-                    return
-                queue = fila["queues"].get(map_key)
-                if not queue:
-                    await interaction.response.send_message("⚠️ Fila desse mapa não existe.", ephemeral=True)
-                    return
-                if uid not in queue["inscritos"]:
-                    await interaction.response.send_message("⚠️ Você não está nessa fila.", ephemeral=True)
-                    return
-                queue["inscritos"].remove(uid)
-                write_data(d)
-            # update pinned message
+# ========== TICKETS ==========
+# Quando uma fila enche, o join só tira o snapshot do roster e reseta a
+# fila; o canal do ticket é criado por workers em background, com retry e
+# backoff, para que o último a entrar receba a resposta na hora.
+TICKET_WORKERS = int(os.getenv("TICKET_WORKERS", "2"))
+TICKET_RETRIES = int(os.getenv("TICKET_RETRIES", "5"))
+TICKET_BACKOFF_MAX = float(os.getenv("TICKET_BACKOFF_MAX", "30"))
+
+ticket_queue = asyncio.Queue()
+
+class TicketJob:
+    def __init__(self, interaction: discord.Interaction, jogo: str, label: str, valor: float, max_p: int, roster: list):
+        self.guild_id = interaction.guild.id
+        self.interaction = interaction  # para o followup de quem completou a fila
+        self.jogo = jogo
+        self.label = label
+        self.valor = valor
+        self.max_p = max_p
+        self.roster = roster
+        self.attempts = 0
+        # progresso, para um retry não recriar o canal nem repetir mensagens
+        self.channel = None
+        self.announced = False
+        self.embed_sent = False
+
+def enqueue_ticket(job: TicketJob):
+    ticket_queue.put_nowait(job)
+    metrics.TICKETS_PENDING.set(ticket_queue.qsize())
+
+def make_ticket_embed(job: TicketJob):
+    total_value = job.max_p * job.valor
+    taxa_total = job.max_p * TAXA_AP
+    emb = discord.Embed(
+        title=f"🎟️ Ticket • {job.label}",
+        description=(
+            f"💸 **Valor por pessoa:** R$ {job.valor:.2f}\n"
+            f"💰 **Total (sem taxa):** R$ {total_value:.2f}\n"
+            f"💸 **Taxa total (R$ {TAXA_AP:.2f} por AP):** R$ {taxa_total:.2f}\n\n"
+            f"🔑 **Chave Pix:** `https://tipa.ai/duckioo23`\n\n"
+            f"⚠️ Enviem o comprovante **neste canal** para começar a partida."
+        ),
+        color=discord.Color.dark_red()
+    )
+    emb.set_thumbnail(url=ICON_URL)
+    return emb
+
+async def create_ticket(job: TicketJob):
+    guild = bot.get_guild(job.guild_id) or job.interaction.guild
+    if job.channel is None:
+        # create ticket channel in appropriate category
+        if job.jogo == "stumble":
+            categoria = discord.utils.get(guild.categories, id=CATEGORIA_STUMBLE)
+        else:
+            categoria = discord.utils.get(guild.categories, id=CATEGORIA_VALORANT)
+        chan_name = f"🎫-{job.label.lower().replace(' ', '')}-apostado"
+        route = f"ticket:{guild.id}"
+        if categoria:
+            job.channel = await ticket_pool.claim(categoria, chan_name)
+        if job.channel is None:
             try:
-                ch = bot.get_channel(int(channel_id))
-                mid = fila.get("message_id")
-                if ch and mid:
-                    m = await ch.fetch_message(mid)
-                    await m.edit(embed=make_queue_embed_single(fila["jogo"], fila, map_key), view=MapButtonsView(channel_id, fila["jogo"]))
-            except Exception:
-                pass
-            await interaction.response.send_message("🚪 Você saiu da fila.", ephemeral=True)
-            return
+                job.channel = await rest.call(partial(guild.create_text_channel, name=chan_name, category=categoria),
+                                              PRIO_TICKET, route)
+            except discord.HTTPException:
+                # fallback to default category
+                job.channel = await rest.call(partial(guild.create_text_channel, name=chan_name), PRIO_TICKET, route)
+    if not job.announced:
+        # ping users
+        users = [guild.get_member(int(x)) for x in job.roster]
+        mentions = " ".join(u.mention for u in users if u)
+        await rest.call(partial(job.channel.send, f"🎮 {mentions} — o confronto foi criado! Enviem o **comprovante do Pix** aqui."),
+                        PRIO_TICKET, f"ticket:{guild.id}")
+        job.announced = True
+    if not job.embed_sent:
+        await rest.call(partial(job.channel.send, embed=make_ticket_embed(job)), PRIO_TICKET, f"ticket:{guild.id}")
+        job.embed_sent = True
 
-        if parts[0] == "ver":
-            channel_id = parts[1]
-            map_key = parts[2]
-            d = read_data()
-            fila = d["filas"].get(channel_id)
-            if not fila:
-                await interaction.response.send_message("⚠️ Fila inexistente.", ephemeral=True)
-                return
-            queue = fila["queues"].get(map_key)
-            if not queue or not queue["inscritos"]:
-                await interaction.response.send_message("Nenhum jogador nessa fila.", ephemeral=True)
-                return
-            mentions = "\n".join(f"<@{x}>" for x in queue["inscritos"])
-            await interaction.response.send_message(f"👥 Jogadores na fila {queue['label']}:\n{mentions}", ephemeral=True)
+async def ticket_worker():
+    while True:
+        job = await ticket_queue.get()
+        try:
+            while True:
+                job.attempts += 1
+                try:
+                    await create_ticket(job)
+                    metrics.TICKETS_CREATED.labels(job.jogo).inc()
+                    break
+                except Exception as e:
+                    if job.attempts >= TICKET_RETRIES:
+                        print(f"Ticket {job.label} falhou após {job.attempts} tentativas:", e)
+                        job = None
+                        break
+                    delay = min(TICKET_BACKOFF_MAX, 2 ** (job.attempts - 1))
+                    print(f"Erro ao criar ticket {job.label} (tentativa {job.attempts}), nova tentativa em {delay}s:", e)
+                    await asyncio.sleep(delay)
+            if job is not None:
+                # notify the user who triggered
+                try:
+                    await rest.call(partial(job.interaction.followup.send, "✅ Fila completa! Ticket criado e fila reiniciada.",
+                                            ephemeral=True), PRIO_INTERACTION, "interaction")
+                except Exception:
+                    pass
+        finally:
+            ticket_queue.task_done()
+            metrics.TICKETS_PENDING.set(ticket_queue.qsize())
+
+# ========== TICKET POOL ==========
+# Pool opcional de canais de ticket já criados (ocultos) por categoria.
+# Uma fila cheia pega um canal do pool, renomeia e sincroniza as permissões
+# com a categoria, em vez de criar do zero. O pool é reabastecido em
+# background quando não há tickets pendentes, e canais mais velhos que
+# TICKET_POOL_MAX_AGE são apagados e substituídos. TICKET_POOL_SIZE=0 desliga.
+TICKET_POOL_SIZE = int(os.getenv("TICKET_POOL_SIZE", "0"))
+TICKET_POOL_MAX_AGE = float(os.getenv("TICKET_POOL_MAX_AGE", str(24 * 3600)))
+TICKET_POOL_INTERVAL = float(os.getenv("TICKET_POOL_INTERVAL", "60"))
+TICKET_POOL_NAME = "ticket-reserva"
+
+class TicketPool:
+    def __init__(self, size: int, max_age: float):
+        self.size = size
+        self.max_age = max_age
+        self._free = {}  # category_id -> [channel_id, ...]
+        self._scanned = set()
+
+    def _discover(self, categoria: discord.CategoryChannel):
+        # canais do pool que sobraram de uma execução anterior
+        if categoria.id in self._scanned:
             return
+        self._scanned.add(categoria.id)
+        free = self._free.setdefault(categoria.id, [])
+        for ch in categoria.text_channels:
+            if ch.name == TICKET_POOL_NAME and ch.id not in free:
+                free.append(ch.id)
 
-        if parts[0] == "verfilas":
-            channel_id = parts[1]
-            d = read_data()
-            fila = d["filas"].get(channel_id)
-            if not fila:
-                await interaction.response.send_message("⚠️ Não há filas nesse canal.", ephemeral=True)
-                return
-            lines = []
-            for map_key, q in fila["queues"].items():
-                lines.append(f"**{q['label']}** — {len(q['inscritos'])}/{q['max_pessoas']}")
-            await interaction.response.send_message("📋 Filas:\n" + "\n".join(lines), ephemeral=True)
+    async def claim(self, categoria: discord.CategoryChannel, name: str):
+        """Retorna um canal do pool já renomeado, ou None se o pool estiver vazio."""
+        free = self._free.get(categoria.id)
+        while free:
+            ch = categoria.guild.get_channel(free.pop(0))
+            if ch is None:
+                continue
+            try:
+                await rest.call(partial(ch.edit, name=name, sync_permissions=True), PRIO_TICKET, f"ticket:{ch.guild.id}")
+                return ch
+            except discord.NotFound:
+                continue
+            except discord.HTTPException as e:
+                print("Erro ao usar canal do pool:", e)
+                # já saiu de _free e _discover não varre a categoria de novo:
+                # apaga agora para o canal oculto não ficar órfão
+                rest.fire(partial(ch.delete, reason="Canal de reserva com falha"), PRIO_POOL, f"pool:{ch.guild.id}")
+        return None
+
+    async def reap(self, categoria: discord.CategoryChannel):
+        free = self._free.get(categoria.id, [])
+        now = discord.utils.utcnow()
+        for ch_id in list(free):
+            ch = categoria.guild.get_channel(ch_id)
+            if ch is None:
+                free.remove(ch_id)
+            elif (now - ch.created_at).total_seconds() > self.max_age:
+                free.remove(ch_id)
+                try:
+                    await rest.call(partial(ch.delete, reason="Canal de reserva expirado"), PRIO_POOL, f"pool:{ch.guild.id}")
+                except discord.HTTPException:
+                    pass
+
+    async def refill(self, categoria: discord.CategoryChannel):
+        free = self._free.setdefault(categoria.id, [])
+        guild = categoria.guild
+        while len(free) < self.size and ticket_queue.empty():
+            overwrites = dict(categoria.overwrites)
+            overwrites[guild.default_role] = discord.PermissionOverwrite(view_channel=False)
+            ch = await rest.call(partial(guild.create_text_channel, name=TICKET_POOL_NAME, category=categoria,
+                                         overwrites=overwrites), PRIO_POOL, f"pool:{guild.id}")
+            free.append(ch.id)
+
+    async def run(self):
+        await bot.wait_until_ready()
+        while True:
+            for guild in bot.guilds:
+                for cat_id in (CATEGORIA_STUMBLE, CATEGORIA_VALORANT):
+                    categoria = discord.utils.get(guild.categories, id=cat_id)
+                    if not categoria:
+                        continue
+                    try:
+                        self._discover(categoria)
+                        await self.reap(categoria)
+                        await self.refill(categoria)
+                    except Exception as e:
+                        print("Erro ao manter pool de tickets:", e)
+            await asyncio.sleep(TICKET_POOL_INTERVAL)
+
+ticket_pool = TicketPool(TICKET_POOL_SIZE, TICKET_POOL_MAX_AGE)
+
+# ========== COMPONENT ROUTER ==========
+# Botões são tratados por uma tabela action -> handler. O custom_id é
+# parseado uma vez (com cache) e a fila/queue é resolvida num lugar só.
+# patterns:
+# mapbtn|<channel_id>|<map_key>
+# verfilas|<channel_id>
+# join|<channel_id>|<map_key>
+# leave|<channel_id>|<map_key>
+# ver|<channel_id>|<map_key>
+COMPONENT_HANDLERS = {}
+
+# SLOW_INTERACTION_MS > 0 liga o log de interações lentas: passado esse tempo,
+# a pilha da task é impressa para mostrar onde ela está parada.
+SLOW_INTERACTION_MS = float(os.getenv("SLOW_INTERACTION_MS", "0"))
+
+# Orçamento (ms) para responder um botão antes de dar defer. Se a média
+# recente da ação já passa do orçamento, o defer sai na hora; senão um timer
+# dispara o defer quando o orçamento estoura. A resposta então vai por followup.
+# INTERACTION_BUDGETS="join=800,mapbtn=1200" ajusta por ação; 0 desliga.
+INTERACTION_BUDGET_MS = float(os.getenv("INTERACTION_BUDGET_MS", "1500"))
+INTERACTION_BUDGETS = {
+    action.strip(): float(ms)
+    for action, _, ms in (p.partition("=") for p in os.getenv("INTERACTION_BUDGETS", "").split(","))
+    if ms.strip()
+}
+_expected_ms = {}  # action -> média móvel da duração do handler
+
+def interaction_budget(action: str) -> float:
+    return INTERACTION_BUDGETS.get(action, INTERACTION_BUDGET_MS)
+
+# Limite por usuário, checado antes de qualquer lock ou I/O: token bucket por
+# (usuário, ação) e debounce por (usuário, botão). RATE_LIMITS="join=4/10"
+# quer dizer 4 cliques de rajada, recarregando 4 a cada 10s; "default" vale
+# para as ações não listadas e N=0 desliga. CLICK_DEBOUNCE_MS=0 desliga o debounce.
+def _parse_rate_limits(raw: str) -> dict:
+    limits = {}
+    for part in raw.split(","):
+        action, _, spec = part.partition("=")
+        if spec.strip():
+            burst, _, per = spec.partition("/")
+            per = float(per or 1)
+            if per <= 0:
+                raise ValueError(f"RATE_LIMITS: janela inválida em {part.strip()!r} (precisa ser > 0s)")
+            limits[action.strip()] = (float(burst), per)
+    return limits
+
+RATE_LIMITS = _parse_rate_limits(os.getenv("RATE_LIMITS", "join=4/10,leave=4/10,default=10/10"))
+RATE_LIMIT_DEFAULT = RATE_LIMITS.pop("default", (10.0, 10.0))
+CLICK_DEBOUNCE_MS = float(os.getenv("CLICK_DEBOUNCE_MS", "750"))
+
+class RateLimiter:
+    SWEEP_EVERY = 60.0
+
+    def __init__(self, limits: dict, default: tuple, debounce: float):
+        self.limits = limits
+        self.default = default
+        self.debounce = debounce
+        self._buckets = {}     # (uid, action) -> [tokens, instante]
+        self._last_click = {}  # (uid, custom_id) -> instante do último clique aceito
+        self._sweep_at = 0.0
+
+    def check(self, uid: int, action: str, custom_id: str, now: float = None):
+        """None se o clique passa; senão o motivo ("debounce" ou "rate")."""
+        now = time.monotonic() if now is None else now
+        if now >= self._sweep_at:
+            self._sweep(now)
+        last = self._last_click.get((uid, custom_id))
+        if last is not None and now - last < self.debounce:
+            return "debounce"
+        burst, per = self.limits.get(action, self.default)
+        if burst > 0:
+            b = self._buckets.get((uid, action))
+            tokens = burst if b is None else min(burst, b[0] + (now - b[1]) * burst / per)
+            if tokens < 1:
+                self._buckets[(uid, action)] = [tokens, now]
+                return "rate"
+            self._buckets[(uid, action)] = [tokens - 1, now]
+        self._last_click[(uid, custom_id)] = now
+        return None
+
+    def _sweep(self, now: float):
+        # esquece quem já recarregou o bucket inteiro / saiu da janela de debounce
+        self._sweep_at = now + self.SWEEP_EVERY
+        for key in [k for k, t in self._last_click.items() if now - t >= self.debounce]:
+            del self._last_click[key]
+        for key, (tokens, t) in list(self._buckets.items()):
+            burst, per = self.limits.get(key[1], self.default)
+            if burst <= 0 or tokens + (now - t) * burst / per >= burst:
+                del self._buckets[key]
+
+limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_DEFAULT, CLICK_DEBOUNCE_MS / 1000)
+
+def component(action: str):
+    """Registra um handler de botão para `action`."""
+    def deco(fn):
+        COMPONENT_HANDLERS[action] = fn
+        return fn
+    return deco
+
+@lru_cache(maxsize=4096)
+def parse_custom_id(custom_id: str):
+    parts = custom_id.split("|")
+    return parts[0], (parts[1] if len(parts) > 1 else None), (parts[2] if len(parts) > 2 else None)
+
+class ComponentContext:
+    __slots__ = ("interaction", "action", "channel_id", "map_key", "uid", "fila", "queue", "acked", "replied", "deferred")
+
+    def __init__(self, interaction: discord.Interaction, action: str, channel_id: str, map_key: str):
+        self.interaction = interaction
+        self.action = action
+        self.channel_id = channel_id
+        self.map_key = map_key
+        self.uid = str(interaction.user.id)
+        self.acked = False     # já saiu uma resposta inicial (mensagem ou defer)
+        self.replied = False
+        self.deferred = None   # Future do defer, se o pipeline deu defer
+        self.resolve()
+
+    def resolve(self):
+        """(Re)carrega fila e queue do estado em memória."""
+        self.fila = read_data()["filas"].get(self.channel_id)
+        self.queue = self.fila["queues"].get(self.map_key) if self.fila and self.map_key else None
+
+    def defer(self, reason: str):
+        """Reconhece a interação já (thinking efêmero); a resposta virá por followup."""
+        if self.acked:
             return
+        self.acked = True
+        self.deferred = rest.submit(partial(self.interaction.response.defer, ephemeral=True, thinking=True),
+                                    PRIO_INTERACTION, "interaction")
+        metrics.INTERACTIONS_DEFERRED.labels(self.action, reason).inc()
+
+    async def reply(self, *args, **kwargs):
+        kwargs.setdefault("ephemeral", True)
+        self.replied = True
+        if not self.acked:
+            self.acked = True
+            return await respond(self.interaction, *args, **kwargs)
+        if self.deferred is not None:
+            await self.deferred
+        await rest.call(partial(self.interaction.followup.send, *args, **kwargs), PRIO_INTERACTION, "interaction")
+
+    async def _discard_thinking(self):
+        await self.deferred
+        await self.interaction.delete_original_response()
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    if not interaction.type == discord.InteractionType.component:
+        return
+    action, channel_id, map_key = parse_custom_id(interaction.data.get("custom_id", ""))
+    handler = COMPONENT_HANDLERS.get(action)
+    if handler is None or channel_id is None:
+        metrics.INTERACTION_ERRORS.labels("unknown").inc()
+        return
+    rejected = limiter.check(interaction.user.id, action, interaction.data["custom_id"])
+    if rejected:
+        metrics.INTERACTIONS_REJECTED.labels(action, rejected).inc()
+        return await respond(interaction, "⏳ Calma! Espere um pouco antes de clicar de novo.", ephemeral=True)
+    t = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    sampler = watchdog = None
+    if SLOW_INTERACTION_MS > 0:
+        sampler = loop.call_later(SLOW_INTERACTION_MS / 1000, _sample_slow, action, asyncio.current_task())
+    ctx = ComponentContext(interaction, action, channel_id, map_key)
+    budget = interaction_budget(action)
+    if budget > 0:
+        if _expected_ms.get(action, 0) > budget:
+            ctx.defer("predicted")
+        else:
+            watchdog = loop.call_later(budget / 1000, ctx.defer, "watchdog")
+    try:
+        await handler(ctx)
+    except StoreBusy:
+        metrics.INTERACTIONS_REJECTED.labels(action, "busy").inc()
+        if not ctx.replied:
+            await ctx.reply(STORE_BUSY_MSG)
     except Exception:
-        # fallback: ignore unknown custom_id structures
+        metrics.INTERACTION_ERRORS.labels(action).inc()
+        print(f"Erro no botão {action}:")
+        traceback.print_exc()
+    finally:
+        elapsed = time.perf_counter() - t
+        metrics.INTERACTION_SECONDS.labels(action).observe(elapsed)
+        prev = _expected_ms.get(action)
+        _expected_ms[action] = elapsed * 1000 if prev is None else 0.8 * prev + 0.2 * elapsed * 1000
+        if watchdog is not None:
+            watchdog.cancel()
+        if ctx.deferred is not None and not ctx.replied:
+            # deu defer mas o handler saiu sem responder: tira o "pensando..."
+            rest.fire(ctx._discard_thinking, PRIO_INTERACTION, "interaction")
+        if sampler is not None:
+            sampler.cancel()
+            if elapsed * 1000 >= SLOW_INTERACTION_MS:
+                print(f"Interação lenta: {action} levou {elapsed * 1000:.0f}ms")
+
+def _sample_slow(action: str, task: asyncio.Task):
+    metrics.SLOW_INTERACTIONS.labels(action).inc()
+    # segue a cadeia de awaits para mostrar onde a task está parada
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    stack = "".join(traceback.StackSummary.extract(frames).format())
+    print(f"Interação {action} passou de {SLOW_INTERACTION_MS:.0f}ms; pilha atual:\n{stack}", end="")
+
+@component("mapbtn")
+async def on_mapbtn(ctx: ComponentContext):
+    # user pressed the map button: show the queue embed and temporary join/leave buttons
+    if ctx.channel_id != str(ctx.interaction.channel.id):
         return
+    if not ctx.fila:
+        return await ctx.reply("⚠️ Esta fila não existe mais.")
+    channel_id, map_key = ctx.channel_id, ctx.map_key
+    # create a view with Join/Leave/Ver buttons specific to this map
+    view = discord.ui.View(timeout=None)
+    join_btn = discord.ui.Button(label="Entrar", style=discord.ButtonStyle.success, custom_id=f"join|{channel_id}|{map_key}")
+    leave_btn = discord.ui.Button(label="Sair", style=discord.ButtonStyle.danger, custom_id=f"leave|{channel_id}|{map_key}")
+    ver_btn = discord.ui.Button(label="Ver jogadores", style=discord.ButtonStyle.secondary, custom_id=f"ver|{channel_id}|{map_key}")
+    view.add_item(join_btn)
+    view.add_item(leave_btn)
+    view.add_item(ver_btn)
+    embed = make_queue_embed_single(ctx.fila["jogo"], ctx.fila, map_key)
+    await ctx.reply(embed=embed, view=view)
+
+# quem já pontuou no ranking em cada rodada de cada fila: entrar, sair e
+# entrar de novo na mesma rodada conta uma vez só
+_ranked_round = {}  # (canal, fila) -> (rodada, {uid})
+
+def first_entry(channel_id: str, map_key: str, rodada: int, uid: str) -> bool:
+    entry = _ranked_round.get((channel_id, map_key))
+    if entry is None or entry[0] != rodada:
+        entry = _ranked_round[(channel_id, map_key)] = (rodada, set())
+    if uid in entry[1]:
+        return False
+    entry[1].add(uid)
+    return True
+
+def join_error(ctx: ComponentContext):
+    """Motivo para recusar o join, ou None se o usuário pode entrar."""
+    fila, queue, uid = ctx.fila, ctx.queue, ctx.uid
+    if not fila:
+        return "⚠️ Fila inexistente."
+    if not queue:
+        return "⚠️ Fila desse mapa não existe."
+    if uid in queue["inscritos"]:
+        return "⚠️ Você já está nessa fila."
+    if len(queue["inscritos"]) >= queue["max_pessoas"]:
+        return "❌ Essa fila já está cheia."
+    mine = store.queues_of(uid)
+    if MAX_QUEUES_PER_USER and len(mine) >= MAX_QUEUES_PER_USER:
+        return f"⚠️ Você já está na fila **{queue_label(*next(iter(mine)))}**. Saia dela antes de entrar em outra."
+    return None
+
+def leave_error(ctx: ComponentContext):
+    if not ctx.fila:
+        return "⚠️ Fila inexistente."
+    if not ctx.queue:
+        return "⚠️ Fila desse mapa não existe."
+    if ctx.uid not in ctx.queue["inscritos"]:
+        return "⚠️ Você não está nessa fila."
+    return None
+
+@component("join")
+async def on_join(ctx: ComponentContext):
+    channel_id, map_key, uid = ctx.channel_id, ctx.map_key, ctx.uid
+    roster = None
+    # only state checks and commits happen under the lock; replies go out after it
+    async with queue_lock(channel_id, map_key):
+        with store.transaction(channel_id):
+            ctx.resolve()
+            fila, queue = ctx.fila, ctx.queue
+            error = join_error(ctx)
+            if not error:
+                commit({"op": "join", "ch": channel_id, "q": map_key, "uid": uid})
+                # update ranking (all-time and the day/week/month rollups), once per round
+                buckets = period_buckets()
+                if first_entry(channel_id, map_key, fila["rodadas"], uid):
+                    commit({"op": "rank", "jogo": fila["jogo"], "uid": uid, "buckets": buckets})
+                label = queue["label"]
+                # If reached capacity -> snapshot roster and reset this queue right away
+                if len(queue["inscritos"]) >= queue["max_pessoas"]:
+                    roster = list(queue["inscritos"])
+                    max_p = queue["max_pessoas"]
+                    commit({"op": "reset", "ch": channel_id, "q": map_key})
+                    commit({"op": "match", "jogo": fila["jogo"], "uids": roster, "valor": fila["valor"],
+                            "taxa": TAXA_AP, "buckets": buckets})
+    if error:
+        return await ctx.reply(error)
+    track_depth(channel_id, map_key)
+
+    # update pinned message if exists (coalesced, outside the lock)
+    panels.schedule(channel_id, map_key)
+
+    try:
+        await ctx.reply(f"✅ Você entrou na fila **{label}**!")
+    finally:
+        if roster:
+            # a fila já foi zerada: o ticket sai mesmo se a resposta falhar
+            # (ex.: 404 "Unknown interaction"); o canal é criado pelo worker
+            enqueue_ticket(TicketJob(ctx.interaction, fila["jogo"], label, fila["valor"], max_p, roster))
+
+@component("leave")
+async def on_leave(ctx: ComponentContext):
+    channel_id, map_key, uid = ctx.channel_id, ctx.map_key, ctx.uid
+    async with queue_lock(channel_id, map_key):
+        with store.transaction(channel_id):
+            ctx.resolve()
+            error = leave_error(ctx)
+            if not error:
+                commit({"op": "leave", "ch": channel_id, "q": map_key, "uid": uid})
+    if error:
+        return await ctx.reply(error)
+    track_depth(channel_id, map_key)
+    # update pinned message
+    panels.schedule(channel_id, map_key)
+    await ctx.reply("🚪 Você saiu da fila.")
+
+@component("ver")
+async def on_ver(ctx: ComponentContext):
+    if not ctx.fila:
+        return await ctx.reply("⚠️ Fila inexistente.")
+    queue = ctx.queue
+    if not queue or not queue["inscritos"]:
+        return await ctx.reply("Nenhum jogador nessa fila.")
+    mentions = "\n".join(f"<@{x}>" for x in queue["inscritos"])
+    await ctx.reply(f"👥 Jogadores na fila {queue['label']}:\n{mentions}")
+
+@component("verfilas")
+async def on_verfilas(ctx: ComponentContext):
+    if not ctx.fila:
+        return await ctx.reply("⚠️ Não há filas nesse canal.")
+    lines = []
+    for map_key, q in ctx.fila["queues"].items():
+        lines.append(f"**{q['label']}** — {len(q['inscritos'])}/{q['max_pessoas']}")
+    await ctx.reply("📋 Filas:\n" + "\n".join(lines))
 
 # ========== COMMANDS ==========
+STORE_BUSY_MSG = "⏳ Muita gente mexendo nas filas agora, tente de novo em instantes."
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    original = getattr(error, "original", error)
+    if isinstance(original, StoreBusy):
+        if not interaction.response.is_done():
+            await respond(interaction, STORE_BUSY_MSG, ephemeral=True)
+        return
+    name = interaction.command.name if interaction.command else "?"
+    print(f"Erro no comando /{name}:")
+    traceback.print_exception(type(error), error, error.__traceback__)
+
 
 # /criar -> Stumble Guys (fixo maps)
 @bot.tree.command(name="criar", description="Cria o painel de Stumble Guys com mapas (Block Dash, Rush Hour, Laser Tracer).")
 @app_commands.describe(valor="Valor da aposta por pessoa (R$)", max_pessoas="Número máximo por fila")
 async def criar(interaction: discord.Interaction, valor: float = 1.0, max_pessoas: int = 8):
     if interaction.user.id not in STAFF_IDS:
-        return await interaction.response.send_message("❌ Você não tem permissão para criar filas.", ephemeral=True)
+        return await respond(interaction, "❌ Você não tem permissão para criar filas.", ephemeral=True)
     if max_pessoas < 2 or max_pessoas > 128:
-        return await interaction.response.send_message("❌ max_pessoas deve ser entre 2 e 128.", ephemeral=True)
+        return await respond(interaction, "❌ max_pessoas deve ser entre 2 e 128.", ephemeral=True)
 
     channel = interaction.channel
     cid = str(channel.id)
-    async with data_lock:
-        d = read_data()
-        ensure_channel_fila_structure(d, cid)
-        fila = d["filas"][cid]
-        fila["jogo"] = "stumble"
-        fila["valor"] = float(valor)
-        fila["rodadas"] = fila.get("rodadas", 1)
-        # ensure queues for the 3 maps exist (keep previous configs if present)
-        for m in STUMBLE_MAPS:
-            k = key_from_name(m)
-            if k not in fila["queues"]:
-                fila["queues"][k] = {"label": m, "inscritos": [], "max_pessoas": max_pessoas, "message_id": None}
-            else:
-                # update max_pessoas default if currently empty
-                fila["queues"][k]["max_pessoas"] = max_pessoas
-        write_data(d)
+    async with channel_lock(cid):
+        with store.transaction(cid):
+            # ensure queues for the 3 maps exist (keep previous configs if present)
+            commit({"op": "setup", "ch": cid, "jogo": "stumble", "valor": float(valor), "max_pessoas": max_pessoas,
+                    "queues": [(key_from_name(m), m) for m in STUMBLE_MAPS]})
 
     # create a message with MapButtonsView
-    view = MapButtonsView(cid, "stumble")
+    invalidate_panel_cache(cid)
+    view = panel_view(cid, "stumble")
     # create a simple embed showing the maps and counts
     desc = "Painel de mapas:\n\n" + "\n".join(f"• {m}" for m in STUMBLE_MAPS)
     embed = discord.Embed(title="🎮 Painel • Stumble Guys", description=desc, color=discord.Color.dark_red())
-    msg = await channel.send(embed=embed, view=view)
+    msg = await rest.call(partial(channel.send, embed=embed, view=view), PRIO_PANEL, f"panel:{cid}")
 
     # pin/unpin and store message_id
-    async with data_lock:
-        d = read_data()
-        fila = d["filas"][cid]
-        await pin_unpin_prev(channel, msg, fila)
-        fila["message_id"] = msg.id
-        write_data(d)
+    fila = read_data()["filas"].get(cid)
+    if fila:
+        pin_unpin_prev(channel, msg, fila)
+    async with channel_lock(cid):
+        with store.transaction(cid):
+            if cid in read_data()["filas"]:
+                commit({"op": "message", "ch": cid, "mid": msg.id})
 
     # register view persistently
     try:
-        bot.add_view(MapButtonsView(cid, "stumble"), message_id=msg.id)
+        bot.add_view(view, message_id=msg.id)
     except Exception:
-        bot.add_view(MapButtonsView(cid, "stumble"))
+        bot.add_view(view)
 
-    await interaction.response.send_message("✅ Painel de Stumble criado e fixado!", ephemeral=True)
+    await respond(interaction, "✅ Painel de Stumble criado e fixado!", ephemeral=True)
 
 
 # /criarvalorant -> Valorant with custom modes (comma-separated)
@@ -405,116 +1113,231 @@ async def criar(interaction: discord.Interaction, valor: float = 1.0, max_pessoa
 @app_commands.describe(valor="Valor da aposta por pessoa (R$)", max_pessoas="Número máximo padrão por fila", modos="Modos separados por vírgula. ex: 1x1,2x2,5x5")
 async def criarvalorant(interaction: discord.Interaction, valor: float = 1.0, max_pessoas: int = 5, modos: str = "1x1,2x2,5x5"):
     if interaction.user.id not in STAFF_IDS:
-        return await interaction.response.send_message("❌ Você não tem permissão para criar filas.", ephemeral=True)
+        return await respond(interaction, "❌ Você não tem permissão para criar filas.", ephemeral=True)
     channel = interaction.channel
     cid = str(channel.id)
     mode_list = [m.strip() for m in modos.split(",") if m.strip()]
     if not mode_list:
-        return await interaction.response.send_message("❌ Forneça ao menos 1 modo.", ephemeral=True)
-    async with data_lock:
-        d = read_data()
-        ensure_channel_fila_structure(d, cid)
-        fila = d["filas"][cid]
-        fila["jogo"] = "valorant"
-        fila["valor"] = float(valor)
-        fila["rodadas"] = fila.get("rodadas", 1)
-        # ensure queues for each mode
-        for m in mode_list:
-            k = key_from_name(m)
-            if k not in fila["queues"]:
-                fila["queues"][k] = {"label": m, "inscritos": [], "max_pessoas": max_pessoas, "message_id": None}
-            else:
-                fila["queues"][k]["max_pessoas"] = max_pessoas
-        write_data(d)
+        return await respond(interaction, "❌ Forneça ao menos 1 modo.", ephemeral=True)
+    async with channel_lock(cid):
+        with store.transaction(cid):
+            # ensure queues for each mode
+            commit({"op": "setup", "ch": cid, "jogo": "valorant", "valor": float(valor), "max_pessoas": max_pessoas,
+                    "queues": [(key_from_name(m), m) for m in mode_list]})
 
-    view = MapButtonsView(cid, "valorant")
+    invalidate_panel_cache(cid)
+    view = panel_view(cid, "valorant")
     desc = "Painel de modos Valorant:\n\n" + "\n".join(f"• {m}" for m in mode_list)
     embed = discord.Embed(title="🎮 Painel • Valorant", description=desc, color=discord.Color.dark_red())
-    msg = await channel.send(embed=embed, view=view)
+    msg = await rest.call(partial(channel.send, embed=embed, view=view), PRIO_PANEL, f"panel:{cid}")
 
-    async with data_lock:
-        d = read_data()
-        fila = d["filas"][cid]
-        await pin_unpin_prev(channel, msg, fila)
-        fila["message_id"] = msg.id
-        write_data(d)
+    fila = read_data()["filas"].get(cid)
+    if fila:
+        pin_unpin_prev(channel, msg, fila)
+    async with channel_lock(cid):
+        with store.transaction(cid):
+            if cid in read_data()["filas"]:
+                commit({"op": "message", "ch": cid, "mid": msg.id})
 
     # persist view
     try:
-        bot.add_view(MapButtonsView(cid, "valorant"), message_id=msg.id)
+        bot.add_view(view, message_id=msg.id)
     except Exception:
-        bot.add_view(MapButtonsView(cid, "valorant"))
+        bot.add_view(view)
+
+    await respond(interaction, f"✅ Painel de Valorant criado e fixado! Modos: {', '.join(mode_list)}", ephemeral=True)
 
-    await interaction.response.send_message(f"✅ Painel de Valorant criado e fixado! Modos: {', '.join(mode_list)}", ephemeral=True)
+# filas do usuário (todos os canais)
+@bot.tree.command(name="minhasfilas", description="Mostra em quais filas você está inscrito.")
+async def minhasfilas(interaction: discord.Interaction):
+    mine = sorted(store.queues_of(str(interaction.user.id)))
+    if not mine:
+        return await respond(interaction, "Você não está em nenhuma fila.", ephemeral=True)
+    lines = [f"**{queue_label(ch, k)}** em <#{ch}>" for ch, k in mine]
+    await respond(interaction, "📋 Suas filas:\n" + "\n".join(lines), ephemeral=True)
+
+@bot.tree.command(name="sairfilas", description="Sai de todas as filas em que você está inscrito.")
+async def sairfilas(interaction: discord.Interaction):
+    uid = str(interaction.user.id)
+    left = 0
+    for ch, k in list(store.queues_of(uid)):
+        async with queue_lock(ch, k):
+            with store.transaction(ch):
+                if (ch, k) in store.queues_of(uid):
+                    commit({"op": "leave", "ch": ch, "q": k, "uid": uid})
+                    left += 1
+        track_depth(ch, k)
+        panels.schedule(ch, k)
+    if not left:
+        return await respond(interaction, "Você não está em nenhuma fila.", ephemeral=True)
+    await respond(interaction, f"🚪 Você saiu de {left} fila(s).", ephemeral=True)
 
 # ranking commands
-@bot.tree.command(name="ranking", description="Mostra ranking geral (especifique jogo: stumble ou valorant)")
-@app_commands.describe(jogo="stumble ou valorant")
-async def ranking(interaction: discord.Interaction, jogo: str = "stumble"):
-    d = read_data()
-    if jogo.lower() == "stumble":
-        rk = d.get("ranking_stumble", {})
+_ranking_embeds = {}  # (jogo, periodo) -> (linhas, Embed)
+
+@bot.tree.command(name="ranking", description="Mostra ranking geral ou do período (especifique jogo: stumble ou valorant)")
+@app_commands.describe(jogo="stumble ou valorant", periodo="geral, dia, semana ou mes")
+async def ranking(interaction: discord.Interaction, jogo: str = "stumble", periodo: str = "geral"):
+    jogo, periodo = jogo.lower(), periodo.lower()
+    bucket = current_bucket(periodo)
+    if bucket is None:
+        periodo = "geral"
+        board = store.board(ranking_key(jogo))
     else:
-        rk = d.get("ranking_valorant", {})
-    if not rk:
-        return await interaction.response.send_message("Nenhum dado de ranking ainda.", ephemeral=True)
-    top = sorted(rk.items(), key=lambda x: x[1], reverse=True)[:10]
-    lines = [f"<@{uid}> — {count} entradas" for uid, count in top]
-    emb = discord.Embed(title=f"🏆 Ranking • {jogo.capitalize()}", description="\n".join(lines), color=discord.Color.gold())
-    await interaction.response.send_message(embed=emb, ephemeral=False)
+        board = store.period_board(jogo, bucket)
+    if not len(board):
+        return await respond(interaction, "Nenhum dado de ranking ainda.", ephemeral=True)
+    # top-10 sai pronto do índice do bucket; partidas e apostado vêm do rollup
+    lines = []
+    for uid, count in board.top(10):
+        _, partidas, apostado = store.period_stats(jogo, bucket or "all", uid)
+        lines.append(f"<@{uid}> — {count} entradas • {partidas} partidas • R$ {apostado:.2f} apostados")
+    # embed só é refeito quando o conteúdo muda
+    emb = _ranking_embeds.get((jogo, periodo))
+    if emb is None or emb[0] != lines:
+        title = f"🏆 Ranking • {jogo.capitalize()}" + ("" if periodo == "geral" else f" • {periodo.capitalize()}")
+        emb = (lines, discord.Embed(title=title, description="\n".join(lines), color=discord.Color.gold()))
+        _ranking_embeds[(jogo, periodo)] = emb
+    await respond(interaction, embed=emb[1], ephemeral=False)
+
+@bot.tree.command(name="posicao", description="Mostra sua posição no ranking (stumble ou valorant)")
+@app_commands.describe(jogo="stumble ou valorant")
+async def posicao(interaction: discord.Interaction, jogo: str = "stumble"):
+    board = store.board(ranking_key(jogo.lower()))
+    pos = board.position(str(interaction.user.id))
+    if pos is None:
+        return await respond(interaction, f"Você ainda não tem entradas no ranking de {jogo.capitalize()}.", ephemeral=True)
+    _, partidas, apostado = store.period_stats(jogo.lower(), "all", str(interaction.user.id))
+    await respond(interaction,
+        f"🏆 Você está em **#{pos[0]}** de {len(board)} no ranking de {jogo.capitalize()} ({pos[1]} entradas, "
+        f"{partidas} partidas, R$ {apostado:.2f} apostados).", ephemeral=True)
 
 # remover painel/fila do canal
 @bot.tree.command(name="remover", description="Remove painel/fila ativa neste canal (desfixa mensagem e limpa filas).")
 async def remover(interaction: discord.Interaction):
     if interaction.user.id not in STAFF_IDS:
-        return await interaction.response.send_message("❌ Sem permissão.", ephemeral=True)
+        return await respond(interaction, "❌ Sem permissão.", ephemeral=True)
     channel = interaction.channel
     cid = str(channel.id)
-    async with data_lock:
-        d = read_data()
-        filas = d.get("filas", {})
-        if cid not in filas:
-            return await interaction.response.send_message("⚠️ Não há painel neste canal.", ephemeral=True)
-        fila = filas[cid]
-        # unpin message if exists
+    async with channel_lock(cid):
+        with store.transaction(cid):
+            filas = read_data().get("filas", {})
+            found = cid in filas
+            if found:
+                mid = filas[cid].get("message_id")
+                map_keys = list(filas[cid]["queues"])
+                # remove structure
+                commit({"op": "remove", "ch": cid})
+    if not found:
+        return await respond(interaction, "⚠️ Não há painel neste canal.", ephemeral=True)
+    for k in map_keys:
+        track_depth(cid, k)
+    panels.forget(mid)
+    invalidate_panel_cache(cid, mid)
+    locks.drop_channel(cid)
+    for k in map_keys:
+        _ranked_round.pop((cid, k), None)
+    # unpin message if exists
+    if mid:
+        rest.fire(partial(_unpin, channel, mid), PRIO_PIN, f"pin:{channel.id}")
+    await respond(interaction, "🗑️ Painel removido e dados limpos.", ephemeral=False)
+
+# ========== STARTUP ==========
+# Tudo aqui roda uma vez, no setup_hook (depois do login, antes do gateway).
+# on_ready pode disparar várias vezes por processo (reconexões) e não faz nada caro.
+COMMAND_HASH_FILE = os.getenv("COMMAND_HASH_FILE", ".commands.sha256")
+FORCE_SYNC = os.getenv("FORCE_SYNC", "0") == "1"
+
+def restore_state():
+    """Restaura views persistentes e métricas num único passe sobre o estado carregado."""
+    for ch_id, fila in read_data()["filas"].items():
+        for map_key in fila["queues"]:
+            track_depth(ch_id, map_key)
         mid = fila.get("message_id")
         if mid:
+            # restore persistent view for the stored panel message
+            view = panel_view(ch_id, fila.get("jogo", "stumble"))
             try:
-                msg = await channel.fetch_message(mid)
-                if msg.pinned:
-                    await msg.unpin()
+                bot.add_view(view, message_id=mid)
             except Exception:
-                pass
-        # remove structure
-        del filas[cid]
-        write_data(d)
-    await interaction.response.send_message("🗑️ Painel removido e dados limpos.", ephemeral=False)
+                try:
+                    bot.add_view(view)
+                except Exception:
+                    pass
+            print(f"Restored view for channel {ch_id} message {mid}")
 
-# ========== STARTUP ==========
-@bot.event
-async def on_ready():
-    print(f"✅ Bot online como {bot.user}")
+def command_tree_hash() -> str:
+    payload = [cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()]
+    raw = json.dumps([bot.application_id, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def sync_commands():
+    """Sincroniza os slash commands só se a árvore mudou desde o último sync."""
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        return  # os comandos são globais: só o processo do shard 0 sincroniza
+    digest = command_tree_hash()
+    try:
+        with open(COMMAND_HASH_FILE, "r", encoding="utf-8") as f:
+            stored = f.read().strip()
+    except OSError:
+        stored = None
+    if stored == digest and not FORCE_SYNC:
+        print("Slash commands sem mudanças; sync pulado.")
+        return
     try:
         await bot.tree.sync()
         print("Slash commands sincronizados.")
     except Exception as e:
         print("Erro ao sincronizar comandos:", e)
+        return
+    with open(COMMAND_HASH_FILE, "w", encoding="utf-8") as f:
+        f.write(digest)
 
-    # restore persistent views for messages stored
-    d = read_data()
-    for ch_id, fila in d.get("filas", {}).items():
-        mid = fila.get("message_id")
-        if mid:
-            try:
-                bot.add_view(MapButtonsView(ch_id, fila.get("jogo", "stumble")), message_id=mid)
-                print(f"Restored view for channel {ch_id} message {mid}")
-            except Exception:
-                try:
-                    bot.add_view(MapButtonsView(ch_id, fila.get("jogo", "stumble")))
-                except Exception:
-                    pass
+@bot.event
+async def on_ready():
+    print(f"✅ Bot online como {bot.user}")
+
+# ========== STATUS ==========
+STARTED_AT = time.time()
+
+def live_status() -> dict:
+    """Estado ao vivo para o /status do keep_alive (roda no loop do bot)."""
+    filas = {}
+    for ch_id, fila in read_data()["filas"].items():
+        filas[ch_id] = {
+            "jogo": fila["jogo"],
+            "valor": fila["valor"],
+            "rodadas": fila.get("rodadas", 1),
+            "queues": {k: {"label": q["label"], "inscritos": len(q["inscritos"]), "max_pessoas": q["max_pessoas"]}
+                       for k, q in fila["queues"].items()},
+        }
+    return {
+        "online": bot.is_ready(),
+        "user": str(bot.user) if bot.user else None,
+        "latency_ms": round(bot.latency * 1000, 1) if bot.is_ready() else None,
+        "guilds": len(bot.guilds),
+        "uptime_s": round(time.time() - STARTED_AT),
+        "storage_mode": store.mode,
+        "shards": sorted(bot.shards) if SHARD_COUNT else None,
+        "filas": filas,
+        "tickets_pendentes": ticket_queue.qsize(),
+        "rest_pendentes": rest.pending(),
+        "pool_tickets": {str(cat): len(ids) for cat, ids in ticket_pool._free.items()},
+    }
 
 # ========== RUN ==========
+async def main():
+    discord.utils.setup_logging()
+    async with bot:
+        # keep_alive.py sobe o HTTP no mesmo loop, antes de conectar ao gateway
+        runner = await keep_alive(live_status)
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await runner.cleanup()
+
 if __name__ == "__main__":
-    keep_alive()  # seu keep_alive.py roda Flask em background
-    bot.run(TOKEN)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,454 @@
+"""Benchmark local do b.py com um gateway falso do Discord.
+
+Roda os handlers de verdade (on_interaction, /criar, /criarvalorant,
+/ranking, /remover) contra objetos falsos de Interaction, Guild,
+TextChannel e Message, com latência de REST e rate limit simulados, e
+imprime p50/p95/p99 de latência das interações, espera em locks, bytes
+gravados em disco e chamadas REST feitas.
+
+uso:
+    python bench.py                       # todos os cenários
+    python bench.py burst --users 500     # um cenário, com parâmetros
+    python bench.py --latency 120 --rate 5 --mode journal
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+
+CANAL_STUMBLE = 1000
+CANAL_VALORANT = 2000
+GUILD_ID = 1
+USER_BASE = 10 ** 17
+
+
+# ========== GATEWAY FALSO ==========
+class FakeRest:
+    """Simula a latência e o rate limit (por rota) da API REST."""
+
+    def __init__(self, latency: float, jitter: float, rate: int, per: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.per = per
+        self.calls = Counter()
+        self.limited = Counter()
+        self._buckets = {}  # route -> [tokens, last_refill]
+
+    async def call(self, route: str):
+        self.calls[route] += 1
+        # respostas de interação usam o token da própria interação, sem bucket compartilhado
+        if self.rate and not route.startswith("interaction."):
+            loop = asyncio.get_running_loop()
+            while True:
+                tokens, last = self._buckets.get(route, (self.rate, loop.time()))
+                now = loop.time()
+                tokens = min(self.rate, tokens + (now - last) * self.rate / self.per)
+                if tokens >= 1:
+                    self._buckets[route] = (tokens - 1, now)
+                    break
+                self._buckets[route] = (tokens, now)
+                self.limited[route] += 1
+                await asyncio.sleep((1 - tokens) * self.per / self.rate)
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+
+class FakeMessage:
+    _ids = 5000
+
+    def __init__(self, gw, channel):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.gw = gw
+        self.channel = channel
+        self.pinned = False
+
+    async def edit(self, **kwargs):
+        await self.gw.rest.call(f"message.edit:{self.channel.id}")
+        return self
+
+    async def pin(self):
+        await self.gw.rest.call(f"message.pin:{self.channel.id}")
+        self.pinned = True
+
+    async def unpin(self):
+        await self.gw.rest.call(f"message.pin:{self.channel.id}")
+        self.pinned = False
+
+
+class FakeTextChannel:
+    def __init__(self, gw, channel_id: int, name: str = "canal", category=None):
+        self.gw = gw
+        self.id = channel_id
+        self.name = name
+        self.category = category
+        self.guild = gw.guild
+        self.messages = {}
+        self.created_at = gw.discord.utils.utcnow()
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, *args, **kwargs):
+        await self.gw.rest.call(f"channel.send:{self.id}")
+        m = FakeMessage(self.gw, self)
+        self.messages[m.id] = m
+        return m
+
+    async def fetch_message(self, mid):
+        await self.gw.rest.call(f"channel.fetch_message:{self.id}")
+        m = self.messages.get(mid)
+        if m is None:
+            raise self.gw.discord.NotFound(FakeResponse(404), "Unknown Message")
+        return m
+
+    def get_partial_message(self, mid):
+        return self.messages.get(mid) or FakeMessage(self.gw, self)
+
+    async def edit(self, **kwargs):
+        await self.gw.rest.call("channel.edit")
+        self.name = kwargs.get("name", self.name)
+
+    async def delete(self, **kwargs):
+        await self.gw.rest.call("channel.delete")
+        self.gw.channels.pop(self.id, None)
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = ""
+
+
+class FakeCategory:
+    def __init__(self, gw, cat_id: int):
+        self.id = cat_id
+        self.guild = gw.guild
+        self.gw = gw
+        self.overwrites = {}
+
+    @property
+    def text_channels(self):
+        return [c for c in self.gw.channels.values() if c.category is self]
+
+
+class FakeMember:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.mention = f"<@{uid}>"
+
+
+class FakeGuild:
+    def __init__(self, gw):
+        self.gw = gw
+        self.id = GUILD_ID
+        self.default_role = object()
+        self.categories = []
+
+    def get_member(self, uid):
+        return FakeMember(uid)
+
+    def get_channel(self, cid):
+        return self.gw.channels.get(cid)
+
+    async def create_text_channel(self, name, category=None, **kwargs):
+        await self.gw.rest.call("guild.create_channel")
+        self.gw._next_channel += 1
+        ch = FakeTextChannel(self.gw, self.gw._next_channel, name, category)
+        self.gw.channels[ch.id] = ch
+        self.gw.tickets_created += 1
+        return ch
+
+
+class FakeInteractionResponse:
+    def __init__(self, inter):
+        self.inter = inter
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _ack(self, route):
+        if self._done:
+            raise RuntimeError("interaction já respondida")
+        self._done = True
+        await self.inter.gw.rest.call(route)
+        self.inter.responded_at = time.perf_counter()
+
+    async def send_message(self, *args, **kwargs):
+        await self._ack("interaction.response")
+
+    async def defer(self, **kwargs):
+        await self._ack("interaction.defer")
+
+
+class FakeFollowup:
+    def __init__(self, inter):
+        self.inter = inter
+
+    async def send(self, *args, **kwargs):
+        await self.inter.gw.rest.call("interaction.followup")
+
+
+class FakeInteraction:
+    def __init__(self, gw, channel, user_id: int, custom_id: str = None):
+        d = gw.discord
+        self.gw = gw
+        self.type = d.InteractionType.component if custom_id else d.InteractionType.application_command
+        self.data = {"custom_id": custom_id} if custom_id else {}
+        self.user = FakeMember(user_id)
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = gw.guild
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.created = time.perf_counter()
+        self.responded_at = None
+
+    async def delete_original_response(self):
+        await self.gw.rest.call("interaction.original")
+
+
+class FakeGateway:
+    def __init__(self, discord_mod, rest: FakeRest):
+        self.discord = discord_mod
+        self.rest = rest
+        self.channels = {}
+        self._next_channel = 900000
+        self.tickets_created = 0
+        self.guild = FakeGuild(self)
+
+    def add_channel(self, cid: int):
+        self.channels[cid] = FakeTextChannel(self, cid)
+        return self.channels[cid]
+
+
+# ========== MEDIÇÃO ==========
+class WaitRecorder:
+    """Envolve um asyncio.Lock guardando cada espera para o relatório do cenário."""
+
+    def __init__(self, lock, stats):
+        self.lock = lock
+        self.stats = stats
+
+    async def acquire(self):
+        t = time.perf_counter()
+        await self.lock.acquire()
+        self.stats.append(time.perf_counter() - t)
+
+    def release(self):
+        self.lock.release()
+
+
+def disk_bytes() -> int:
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# ========== CENÁRIOS ==========
+async def scenario_burst(h, args):
+    """N usuários entrando nas 3 filas de Stumble em `duration` segundos."""
+    await h.command("criar", CANAL_STUMBLE, valor=5.0, max_pessoas=args.max_pessoas)
+    maps = [h.b.key_from_name(m) for m in h.b.STUMBLE_MAPS]
+    clicks = []
+    for i in range(args.users):
+        at = random.uniform(0, args.duration)
+        clicks.append((at, f"join|{CANAL_STUMBLE}|{random.choice(maps)}", USER_BASE + i))
+    await h.replay(clicks)
+
+
+async def scenario_valorant(h, args):
+    """Filas 5x5 enchendo ao mesmo tempo que joins/leaves no Stumble."""
+    await h.command("criarvalorant", CANAL_VALORANT, valor=10.0, max_pessoas=10, modos="1x1,2x2,5x5")
+    await h.command("criar", CANAL_STUMBLE, valor=5.0, max_pessoas=args.max_pessoas)
+    clicks = []
+    for i in range(args.users):
+        uid = USER_BASE + i
+        at = random.uniform(0, args.duration)
+        if i % 2:
+            clicks.append((at, f"join|{CANAL_VALORANT}|5x5", uid))
+        else:
+            m = h.b.key_from_name(random.choice(h.b.STUMBLE_MAPS))
+            clicks.append((at, f"join|{CANAL_STUMBLE}|{m}", uid))
+            clicks.append((at + random.uniform(0.1, 1.0), f"leave|{CANAL_STUMBLE}|{m}", uid))
+    await h.replay(clicks)
+
+
+async def scenario_mixed(h, args):
+    """Mistura de cliques de leitura (ver/verfilas/mapbtn), joins e /ranking (todos os períodos)."""
+    await h.command("criar", CANAL_STUMBLE, valor=5.0, max_pessoas=args.max_pessoas)
+    maps = [h.b.key_from_name(m) for m in h.b.STUMBLE_MAPS]
+    clicks = []
+    for i in range(args.users):
+        uid = USER_BASE + i
+        m = random.choice(maps)
+        at = random.uniform(0, args.duration)
+        clicks.append((at, f"mapbtn|{CANAL_STUMBLE}|{m}", uid))
+        clicks.append((at + 0.2, f"join|{CANAL_STUMBLE}|{m}", uid))
+        clicks.append((at + 0.4, f"ver|{CANAL_STUMBLE}|{m}", uid))
+        clicks.append((at + 0.5, f"verfilas|{CANAL_STUMBLE}", uid))
+        if i % 10 == 0:
+            periodo = random.choice(["geral", "dia", "semana", "mes"])
+            clicks.append((at + 0.6, ("ranking", {"jogo": "stumble", "periodo": periodo}), uid))
+    await h.replay(clicks)
+    await h.command("remover", CANAL_STUMBLE)
+
+
+SCENARIOS = {
+    "burst": scenario_burst,
+    "valorant": scenario_valorant,
+    "mixed": scenario_mixed,
+}
+
+
+# ========== HARNESS ==========
+class Harness:
+    def __init__(self, b, gw):
+        self.b = b
+        self.gw = gw
+        self.latencies = defaultdict(list)  # action -> [s]
+        self.lock_waits = []
+        self.unanswered = 0
+
+    async def command(self, name, channel_id, user_id=None, **kwargs):
+        ch = self.gw.channels.get(channel_id) or self.gw.add_channel(channel_id)
+        inter = FakeInteraction(self.gw, ch, user_id or self.b.STAFF_IDS[0])
+        await getattr(self.b, name).callback(inter, **kwargs)
+        self._record(name, inter)
+
+    async def click(self, custom_id, user_id):
+        if isinstance(custom_id, tuple):
+            # comando de barra no meio dos cliques
+            return await self.command(custom_id[0], CANAL_STUMBLE, user_id, **custom_id[1])
+        channel_id = int(custom_id.split("|")[1])
+        ch = self.gw.channels.get(channel_id) or self.gw.add_channel(channel_id)
+        inter = FakeInteraction(self.gw, ch, user_id, custom_id)
+        await self.b.on_interaction(inter)
+        self._record(custom_id.split("|")[0], inter)
+
+    def _record(self, action, inter):
+        if inter.responded_at is None:
+            self.unanswered += 1
+        else:
+            self.latencies[action].append(inter.responded_at - inter.created)
+
+    async def replay(self, clicks):
+        start = asyncio.get_running_loop().time()
+        tasks = []
+        for at, custom_id, uid in sorted(clicks, key=lambda c: c[0]):
+            delay = start + at - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.click(custom_id, uid)))
+        await asyncio.gather(*tasks)
+
+
+def load_bot(args, workdir):
+    os.chdir(workdir)
+    os.environ.setdefault("DISCORD_TOKEN", "bench")
+    os.environ["STORAGE_MODE"] = args.mode
+    os.environ["MAX_QUEUES_PER_USER"] = str(args.max_queues)
+    os.environ["INTERACTION_BUDGET_MS"] = str(args.budget)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import discord
+    import b
+    return discord, b
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="fila-bench-")
+    discord, b = load_bot(args, workdir)
+    rest = FakeRest(args.latency / 1000, args.jitter / 1000, args.rate, args.per)
+    gw = FakeGateway(discord, rest)
+    gw.guild.categories = [FakeCategory(gw, b.CATEGORIA_STUMBLE), FakeCategory(gw, b.CATEGORIA_VALORANT)]
+    # o bot "enxerga" só o gateway falso
+    b.bot.get_channel = gw.channels.get
+    b.bot.get_guild = lambda gid: gw.guild
+    h = Harness(b, gw)
+    real_get = b.locks.get
+    b.locks.get = lambda key: WaitRecorder(real_get(key), h.lock_waits)
+    tasks = [asyncio.create_task(b.store.run_flusher())]
+    tasks += [asyncio.create_task(b.ticket_worker()) for _ in range(b.TICKET_WORKERS)]
+
+    names = [args.scenario] if args.scenario else list(SCENARIOS)
+    for name in names:
+        h.latencies.clear()
+        h.lock_waits.clear()
+        h.unanswered = 0
+        rest.calls.clear()
+        rest.limited.clear()
+        gw.tickets_created = 0
+        io0 = disk_bytes()
+        t0 = time.perf_counter()
+        await SCENARIOS[name](h, args)
+        await b.ticket_queue.join()
+        await asyncio.sleep(b.PANEL_EDIT_DELAY + args.latency / 1000 * 2)
+        if b.store.mode == "json":
+            b.store.flush()
+        report(name, h, rest, gw, time.perf_counter() - t0, disk_bytes() - io0)
+
+    for t in tasks:
+        t.cancel()
+
+
+def report(name, h, rest, gw, elapsed, written):
+    print(f"\n=== {name} ({elapsed:.1f}s) ===")
+    print(f"{'ação':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, lat in sorted(h.latencies.items()):
+        print(f"{action:<14}{len(lat):>6}{pct(lat, 50) * 1000:>10.1f}{pct(lat, 95) * 1000:>10.1f}{pct(lat, 99) * 1000:>10.1f}")
+    if h.unanswered:
+        print(f"sem resposta: {h.unanswered}")
+    w = h.lock_waits
+    print(f"lock wait: n={len(w)} total={sum(w) * 1000:.1f}ms p99={pct(w, 99) * 1000:.1f}ms max={max(w, default=0) * 1000:.1f}ms")
+    print(f"disco: {written} bytes gravados")
+    print(f"tickets criados: {gw.tickets_created}")
+    print(f"REST: {sum(rest.calls.values())} chamadas, {sum(rest.limited.values())} esperas por rate limit")
+    # agrupa as rotas por tipo (sem o id do canal)
+    calls, limited = Counter(), Counter()
+    for route, n in rest.calls.items():
+        calls[route.split(":")[0]] += n
+        limited[route.split(":")[0]] += rest.limited[route]
+    for route, n in calls.most_common():
+        extra = f" ({limited[route]} limitadas)" if limited[route] else ""
+        print(f"  {route:<24}{n:>6}{extra}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark do bot de filas com gateway falso.")
+    p.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS), help="cenário (padrão: todos)")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--duration", type=float, default=5.0, help="janela de chegada dos cliques (s)")
+    p.add_argument("--max-pessoas", type=int, default=8)
+    p.add_argument("--max-queues", type=int, default=0, help="MAX_QUEUES_PER_USER (0 = sem limite)")
+    p.add_argument("--latency", type=float, default=80.0, help="latência média do REST (ms)")
+    p.add_argument("--jitter", type=float, default=20.0, help="desvio da latência (ms)")
+    p.add_argument("--rate", type=int, default=5, help="requisições por rota por janela (0 = sem limite)")
+    p.add_argument("--per", type=float, default=5.0, help="janela do rate limit (s)")
+    p.add_argument("--budget", type=float, default=1500.0, help="INTERACTION_BUDGET_MS (0 = sem defer)")
+    p.add_argument("--mode", choices=["json", "journal", "sqlite", "shared"], default="json", help="STORAGE_MODE")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
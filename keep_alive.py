@@ -1,15 +1,31 @@
-from flask import Flask
-from threading import Thread
+import os
+from aiohttp import web
+import metrics
 
-app = Flask('')
+# servidor HTTP de health/métricas rodando no mesmo event loop do bot
+HOST = os.getenv("KEEP_ALIVE_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
 
-@app.route('/')
-def home():
-    return "Bot ativo e funcionando!"
+async def home(request):
+    return web.Response(text="Bot ativo e funcionando!")
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+async def status(request):
+    # status_provider é uma função do bot chamada no próprio loop, então
+    # pode ler o estado ao vivo sem locks
+    return web.json_response(request.app["status_provider"]())
+
+async def keep_alive(status_provider=dict) -> web.AppRunner:
+    """Sobe o servidor no loop atual e devolve o runner (use runner.cleanup() ao desligar)."""
+    app = web.Application()
+    app["status_provider"] = status_provider
+    app.router.add_get('/', home)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/status', status)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
@@ -0,0 +1,154 @@
+import threading
+from bisect import bisect_left
+
+# buckets padrão (segundos), de 1ms a 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(values, None)
+
+    def render(self) -> list:
+        with self._lock:
+            children = list(self._children.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def dec(self, n: float = 1):
+        self.value -= n
+
+    def set(self, v: float):
+        self.value = v
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, n: float = 1):
+        self.labels().inc(n)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_fmt_labels(self.label_names, values)} {child.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, v: float):
+        self.labels().set(v)
+
+
+class _Hist:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return _Hist(self.buckets)
+
+    def observe(self, v: float):
+        self.labels().observe(v)
+
+    def _render_child(self, values, child):
+        lines = []
+        acc = 0
+        for le, n in zip(self.buckets + (float("inf"),), list(child.counts)):
+            acc += n
+            le_label = 'le="+Inf"' if le == float("inf") else f'le="{le!r}"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, values, [le_label])} {acc}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, values)} {child.sum}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.label_names, values)} {child.count}")
+        return lines
+
+
+registry = []
+
+
+def render() -> str:
+    """Todas as métricas no formato texto do Prometheus."""
+    lines = []
+    for m in list(registry):
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ========== MÉTRICAS DO BOT ==========
+INTERACTION_SECONDS = Histogram("fila_interaction_seconds", "Duração dos handlers de botão", ["action"])
+INTERACTION_ERRORS = Counter("fila_interaction_errors_total", "Falhas nos handlers de botão", ["action"])
+INTERACTIONS_DEFERRED = Counter("fila_interactions_deferred_total", "Botões reconhecidos com defer antes da resposta", ["action", "reason"])
+INTERACTIONS_REJECTED = Counter("fila_interactions_rejected_total", "Cliques recusados pelo limite por usuário", ["action", "reason"])
+SLOW_INTERACTIONS = Counter("fila_slow_interactions_total", "Interações acima de SLOW_INTERACTION_MS", ["action"])
+LOCK_WAIT_SECONDS = Histogram("fila_lock_wait_seconds", "Espera para adquirir locks de fila/canal", ["scope"])
+LOCK_HOLD_SECONDS = Histogram("fila_lock_hold_seconds", "Tempo com locks de fila/canal seguros", ["scope"])
+STORE_COMMIT_SECONDS = Histogram("fila_store_commit_seconds", "Duração de Store.commit (aplicar + registrar)", ["mode"])
+STORE_WRITE_SECONDS = Histogram("fila_store_write_seconds", "Duração das gravações de snapshot/journal", ["kind"])
+STORE_WRITE_BYTES = Counter("fila_store_write_bytes_total", "Bytes gravados pelo Store", ["kind"])
+STORE_LOAD_SECONDS = Gauge("fila_store_load_seconds", "Duração da última carga do estado")
+REST_SECONDS = Histogram("fila_rest_seconds", "Latência das chamadas REST ao Discord", ["method", "route"])
+REST_CALLS = Counter("fila_rest_calls_total", "Chamadas REST ao Discord", ["method", "route", "status"])
+REST_QUEUE_SECONDS = Histogram("fila_rest_queue_seconds", "Espera na fila do agendador REST", ["priority"])
+REST_QUEUED = Gauge("fila_rest_queued", "Pedidos REST aguardando no agendador", ["priority"])
+REST_SUPERSEDED = Counter("fila_rest_superseded_total", "Pedidos REST descartados por um mais novo", ["priority"])
+QUEUE_DEPTH = Gauge("fila_queue_depth", "Inscritos por fila", ["channel", "queue"])
+TICKETS_CREATED = Counter("fila_tickets_created_total", "Tickets criados", ["jogo"])
+TICKETS_PENDING = Gauge("fila_tickets_pending", "Tickets aguardando o worker")
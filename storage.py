@@ -0,0 +1,1351 @@
+import io
+import os
+import sys
+import time
+import json
+import asyncio
+import sqlite3
+import struct
+from bisect import insort
+from contextlib import contextmanager
+
+import metrics
+
+# estrutura base do arquivo de dados
+BASE_DATA = {
+    "filas": {},  # keyed by channel_id -> dict of queues per map/mode
+    "ranking_stumble": {},
+    "ranking_valorant": {},
+    "rollups": {}  # jogo -> bucket -> uid -> [entradas, partidas, apostado]
+}
+
+# Buckets de período guardados por tipo (o "all" nunca expira). Os ids
+# ("d:2026-10-17", "w:2026-W42", "m:2026-10") ordenam como texto.
+ROLLUP_RETENTION = {"d": 35, "w": 16, "m": 13}
+
+
+class Roster:
+    """Inscritos de uma fila: mantém a ordem de chegada com pertinência,
+    entrada e saída em O(1). Vira lista ao serializar (json default=list)."""
+
+    __slots__ = ("_d",)
+
+    def __init__(self, uids=()):
+        self._d = dict.fromkeys(uids)
+
+    def add(self, uid: str):
+        self._d[uid] = None
+
+    def discard(self, uid: str):
+        self._d.pop(uid, None)
+
+    def __contains__(self, uid):
+        return uid in self._d
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Roster, list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"Roster({list(self._d)!r})"
+
+
+def hydrate(d: dict) -> dict:
+    """Troca as listas de inscritos carregadas do JSON por Roster."""
+    for fila in d.get("filas", {}).values():
+        for q in fila.get("queues", {}).values():
+            q["inscritos"] = Roster(q.get("inscritos", []))
+    return d
+
+
+def ensure_channel_fila_structure(d: dict, channel_id: str):
+    """Garante que exista estrutura para esse canal em dados"""
+    if "filas" not in d:
+        d["filas"] = {}
+    if channel_id not in d["filas"]:
+        d["filas"][channel_id] = {
+            "jogo": "stumble",  # default until set by command
+            "valor": 1.0,
+            "rodadas": 1,
+            "queues": {},  # map_key -> { label, inscritos:list, max_pessoas:int, message_id }
+        }
+
+
+# ========== MUTAÇÕES ==========
+# Toda alteração do estado passa por um "op" (dict pequeno e serializável).
+# O mesmo código aplica o op ao vivo e no replay do journal.
+
+def _op_setup(d, op):
+    ch = op["ch"]
+    ensure_channel_fila_structure(d, ch)
+    fila = d["filas"][ch]
+    fila["jogo"] = op["jogo"]
+    fila["valor"] = float(op["valor"])
+    fila["rodadas"] = fila.get("rodadas", 1)
+    for k, label in op["queues"]:
+        if k not in fila["queues"]:
+            fila["queues"][k] = {"label": label, "inscritos": Roster(), "max_pessoas": op["max_pessoas"], "message_id": None}
+        else:
+            fila["queues"][k]["max_pessoas"] = op["max_pessoas"]
+
+def _op_message(d, op):
+    d["filas"][op["ch"]]["message_id"] = op["mid"]
+
+def _op_remove(d, op):
+    d["filas"].pop(op["ch"], None)
+
+def _op_join(d, op):
+    d["filas"][op["ch"]]["queues"][op["q"]]["inscritos"].add(op["uid"])
+
+def _op_leave(d, op):
+    d["filas"][op["ch"]]["queues"][op["q"]]["inscritos"].discard(op["uid"])
+
+def _op_reset(d, op):
+    fila = d["filas"][op["ch"]]
+    fila["queues"][op["q"]]["inscritos"] = Roster()
+    fila["rodadas"] = fila.get("rodadas", 1) + 1
+
+def _op_rank(d, op):
+    rk = d.setdefault(ranking_key(op["jogo"]), {})
+    rk[op["uid"]] = rk.get(op["uid"], 0) + 1
+    _rollup_add(d, op["jogo"], op.get("buckets", ()), (op["uid"],), 1, 0, 0.0)
+
+def _op_match(d, op):
+    # fila completa: cada jogador soma uma partida e o valor + taxa que pagou
+    _rollup_add(d, op["jogo"], op.get("buckets", ()), op["uids"], 0, 1, float(op["valor"]) + float(op.get("taxa", 0)))
+
+def _rollup_add(d, jogo, buckets, uids, entradas, partidas, apostado):
+    by_bucket = d.setdefault("rollups", {}).setdefault(jogo, {})
+    for b in buckets:
+        rows = by_bucket.get(b)
+        if rows is None:
+            rows = by_bucket[b] = {}
+            _prune_rollups(by_bucket, b)
+        for uid in uids:
+            row = rows.get(uid)
+            if row is None:
+                row = rows[uid] = [0, 0, 0.0]
+            row[0] += entradas
+            row[1] += partidas
+            row[2] += apostado
+
+def _prune_rollups(by_bucket: dict, new_bucket: str):
+    kind = new_bucket.split(":", 1)[0]
+    keep = ROLLUP_RETENTION.get(kind)
+    if keep is None:
+        return
+    same = sorted(b for b in by_bucket if b.startswith(kind + ":"))
+    for old in same[:-keep]:
+        del by_bucket[old]
+
+def rollup_cutoff(by_bucket: dict, kind: str):
+    """Bucket mais antigo ainda guardado para `kind` (tudo antes dele expirou)."""
+    return min((b for b in by_bucket if b.startswith(kind + ":")), default=None)
+
+OPS = {
+    "setup": _op_setup,
+    "message": _op_message,
+    "remove": _op_remove,
+    "join": _op_join,
+    "leave": _op_leave,
+    "reset": _op_reset,
+    "rank": _op_rank,
+    "match": _op_match,
+}
+
+def ranking_key(jogo: str) -> str:
+    return "ranking_stumble" if jogo == "stumble" else "ranking_valorant"
+
+def apply_op(d: dict, op: dict):
+    OPS[op["op"]](d, op)
+
+
+class MemberIndex:
+    """Índice reverso usuário -> filas {(channel_id, map_key)} em que está."""
+
+    def __init__(self):
+        self._by_user = {}
+
+    def rebuild(self, d: dict):
+        self._by_user = {}
+        for ch, fila in d.get("filas", {}).items():
+            for k, q in fila.get("queues", {}).items():
+                for uid in q["inscritos"]:
+                    self._by_user.setdefault(uid, set()).add((ch, k))
+
+    def _discard(self, uid, key):
+        keys = self._by_user.get(uid)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[uid]
+
+    def update(self, d: dict, op: dict):
+        """Atualiza o índice para `op`; chamar antes de aplicar o op."""
+        kind = op["op"]
+        if kind == "join":
+            self._by_user.setdefault(op["uid"], set()).add((op["ch"], op["q"]))
+        elif kind == "leave":
+            self._discard(op["uid"], (op["ch"], op["q"]))
+        elif kind == "reset":
+            for uid in d["filas"][op["ch"]]["queues"][op["q"]]["inscritos"]:
+                self._discard(uid, (op["ch"], op["q"]))
+        elif kind == "remove":
+            fila = d["filas"].get(op["ch"])
+            for k, q in (fila["queues"].items() if fila else ()):
+                for uid in q["inscritos"]:
+                    self._discard(uid, (op["ch"], k))
+
+    def drop_channel(self, d: dict, ch: str):
+        fila = d["filas"].get(ch)
+        for k, q in (fila["queues"].items() if fila else ()):
+            for uid in q["inscritos"]:
+                self._discard(uid, (ch, k))
+
+    def add_channel(self, d: dict, ch: str):
+        fila = d["filas"].get(ch)
+        for k, q in (fila["queues"].items() if fila else ()):
+            for uid in q["inscritos"]:
+                self._by_user.setdefault(uid, set()).add((ch, k))
+
+    def queues_of(self, uid: str) -> set:
+        return self._by_user.get(uid, set())
+
+
+# ========== RANKING ==========
+class Leaderboard:
+    """Ranking mantido incrementalmente.
+
+    Uma Fenwick tree indexada pela contagem guarda quantos usuários têm cada
+    valor, então a posição de um usuário sai em O(log n). O top-K fica numa
+    lista pequena e ordenada; como as contagens só sobem, só quem acabou de
+    ser incrementado pode entrar nela.
+    """
+
+    def __init__(self, counts: dict = None, k: int = 10):
+        self.k = k
+        self.counts = {}
+        self._size = 64
+        self._tree = [0] * (self._size + 1)
+        self._top = []  # [(-count, uid)] ordenado, no máximo k itens
+        for uid, n in (counts or {}).items():
+            self.counts[uid] = n
+        self._rebuild()
+
+    def _rebuild(self):
+        top = max(self.counts.values(), default=0)
+        while self._size < top:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+        for n in self.counts.values():
+            if n > 0:
+                self._add(n, 1)
+        self._top = sorted((-n, uid) for uid, n in self.counts.items() if n > 0)[:self.k]
+
+    def _add(self, i: int, delta: int):
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> int:
+        """Quantos usuários têm contagem entre 1 e i."""
+        total = 0
+        i = min(i, self._size)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def replace(self, counts: dict):
+        """Troca as contagens (ex.: relidas do banco); só reconstrói se mudou."""
+        if counts != self.counts:
+            self.counts = dict(counts)
+            self._rebuild()
+
+    def incr(self, uid: str, n: int = 1):
+        old = self.counts.get(uid, 0)
+        new = old + n
+        self.counts[uid] = new
+        if new > self._size:
+            self._rebuild()
+            return
+        if old:
+            self._add(old, -1)
+        self._add(new, 1)
+        # atualiza o top-K
+        if (-old, uid) in self._top:
+            self._top.remove((-old, uid))
+            insort(self._top, (-new, uid))
+        elif len(self._top) < self.k or (-new, uid) < self._top[-1]:
+            insort(self._top, (-new, uid))
+            del self._top[self.k:]
+
+    def top(self, n: int = 10):
+        if n > self.k:
+            # fallback para pedidos maiores que o índice
+            return sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))[:n]
+        return [(uid, -neg) for neg, uid in self._top[:n]]
+
+    def position(self, uid: str):
+        """(posição, contagem) do usuário, ou None se ele não está no ranking."""
+        n = self.counts.get(uid, 0)
+        if n <= 0:
+            return None
+        return len(self.counts) - self._prefix(n) + 1, n
+
+    def __len__(self):
+        return len(self.counts)
+
+
+# ========== FORMATO COMPACTO ==========
+# Arquivo = cabeçalho (MAGIC + versão) seguido de registros, cada um com 4
+# bytes de tamanho (big-endian) e um JSON compacto. Um registro por canal e
+# rankings em pedaços de RANK_CHUNK usuários, então dá para ler, gravar e
+# migrar registro a registro. Tipos de registro ("t"):
+#   meta  {"seq"}                        número do último op (modo journal)
+#   fila  {"ch", "fila"}                 uma fila de canal no layout atual
+#   rank  {"board", "counts"}            pedaço de um ranking
+#   rollup {"jogo", "bucket", "rows"}    pedaço de um bucket de período
+MAGIC = b"FILA"
+FORMAT_VERSION = 1
+RANK_CHUNK = 1000
+_HEADER = struct.Struct(">4sB")
+_LEN = struct.Struct(">I")
+
+
+def is_compact(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_records(f, records):
+    """Grava o cabeçalho e `records` no arquivo binário `f`; devolve os bytes gravados."""
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+    total = _HEADER.size
+    for rec in records:
+        raw = json.dumps(rec, separators=(",", ":"), ensure_ascii=False, default=list).encode("utf-8")
+        f.write(_LEN.pack(len(raw)))
+        f.write(raw)
+        total += _LEN.size + len(raw)
+    return total
+
+
+def read_records(f):
+    magic, version = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("não é um arquivo no formato compacto")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"formato versão {version} é mais novo que o suportado ({FORMAT_VERSION})")
+    while True:
+        head = f.read(_LEN.size)
+        if len(head) < _LEN.size:
+            return  # fim (ou cabeçalho de registro cortado por um crash)
+        (n,) = _LEN.unpack(head)
+        raw = f.read(n)
+        if len(raw) < n:
+            return
+        yield json.loads(raw)
+
+
+def state_records(d: dict, seq: int = 0):
+    """Registros do formato compacto para o estado `d`."""
+    yield {"t": "meta", "seq": seq}
+    for ch, fila in d.get("filas", {}).items():
+        yield {"t": "fila", "ch": ch, "fila": fila}
+    for board, counts in d.items():
+        if board.startswith("ranking_"):
+            items = list(counts.items())
+            for i in range(0, len(items), RANK_CHUNK):
+                yield {"t": "rank", "board": board, "counts": dict(items[i:i + RANK_CHUNK])}
+    for jogo, by_bucket in d.get("rollups", {}).items():
+        for bucket, rows in by_bucket.items():
+            items = list(rows.items())
+            for i in range(0, max(len(items), 1), RANK_CHUNK):
+                yield {"t": "rollup", "jogo": jogo, "bucket": bucket, "rows": dict(items[i:i + RANK_CHUNK])}
+
+
+def state_from_records(records):
+    """(estado, seq) montado a partir dos registros."""
+    d = json.loads(json.dumps(BASE_DATA))
+    seq = 0
+    for rec in records:
+        kind = rec.get("t")
+        if kind == "meta":
+            seq = rec.get("seq", 0)
+        elif kind == "fila":
+            fila = rec["fila"]
+            for q in fila.get("queues", {}).values():
+                q["inscritos"] = Roster(q.get("inscritos", []))
+            d["filas"][rec["ch"]] = fila
+        elif kind == "rank":
+            d.setdefault(rec["board"], {}).update(rec["counts"])
+        elif kind == "rollup":
+            d["rollups"].setdefault(rec["jogo"], {}).setdefault(rec["bucket"], {}).update(rec["rows"])
+    return d, seq
+
+
+# ========== MIGRAÇÃO ==========
+# Leitor de JSON em streaming: percorre os objetos do topo (e de um nível
+# abaixo) decodificando um valor por vez, sem carregar o arquivo inteiro.
+_decoder = json.JSONDecoder()
+
+
+class _JsonStream:
+    def __init__(self, f, chunk: int = 1 << 16):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self, size: int = 0) -> bool:
+        data = self.f.read(size or self.chunk)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"JSON inválido: esperava {ch!r} na posição {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        # cada nova tentativa decodifica o valor do começo: a leitura dobra a
+        # cada vez para o custo total ficar linear no tamanho do valor
+        size = self.chunk
+        while True:
+            try:
+                v, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            # um número no fim do buffer pode estar cortado: lê mais e tenta de novo
+            if end == len(self.buf) and self._fill(size):
+                size *= 2
+                continue
+            self.pos = end
+            return v
+
+    def keys(self):
+        """Chaves do objeto atual; quem itera consome cada valor (value() ou keys())."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            sep = self.peek()
+            self.pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise ValueError(f"JSON inválido na posição {self.pos}")
+
+
+def _norm_jogo(jogo: str) -> str:
+    return "valorant" if "valorant" in str(jogo).lower() else "stumble"
+
+
+def _current_fila(fila: dict) -> dict:
+    """Fila no layout atual (dados.json), com os campos que faltarem."""
+    out = {
+        "jogo": _norm_jogo(fila.get("jogo", "stumble")),
+        "valor": float(fila.get("valor", 1.0)),
+        "rodadas": fila.get("rodadas", 1),
+        "queues": {},
+        "message_id": fila.get("message_id"),
+    }
+    for k, q in fila.get("queues", {}).items():
+        out["queues"][k] = {"label": q.get("label", k), "inscritos": list(q.get("inscritos", [])),
+                            "max_pessoas": q.get("max_pessoas", 2), "message_id": q.get("message_id")}
+    return out
+
+
+def _legacy_fila(rec: dict) -> dict:
+    """Registro antigo de fila única (filas.json / db.json) no layout atual.
+
+    O bot antigo tinha uma só fila por canal, sem mapas/modos; ela vira a
+    fila "geral" do canal.
+    """
+    return {
+        "jogo": _norm_jogo(rec.get("jogo", "stumble")),
+        "valor": float(rec.get("valor", 1.0)),
+        "rodadas": rec.get("rodadas", rec.get("rodada", 1)),
+        "queues": {"geral": {"label": "Geral", "inscritos": [str(u) for u in rec.get("inscritos", [])],
+                             "max_pessoas": rec.get("max_pessoas", rec.get("max", 2)), "message_id": None}},
+        "message_id": rec.get("message_id", rec.get("mensagem_id")),
+    }
+
+
+def legacy_records(path: str, skipped: list = None):
+    """Registros do formato compacto lidos em streaming de qualquer layout JSON.
+
+    - dados.json: {"filas": {canal: fila}, "ranking_<jogo>": {uid: n}, "seq"?}
+    - filas.json: {canal: {jogo, valor, max, inscritos, mensagem_id, rodada}}
+    - db.json:    {"queues": {canal: registro antigo}, "tickets": {...}}
+    Registros sem id de canal (chaveados pelo nome do jogo) e tickets antigos
+    não têm lugar no estado atual; as chaves vão para `skipped`.
+    """
+    skipped = [] if skipped is None else skipped
+    with open(path, "r", encoding="utf-8") as f:
+        s = _JsonStream(f)
+        for key in s.keys():
+            if key == "filas":
+                for ch in s.keys():
+                    yield {"t": "fila", "ch": ch, "fila": _current_fila(s.value())}
+            elif key == "queues":
+                for ch in s.keys():
+                    rec = s.value()
+                    if ch.isdigit():
+                        yield {"t": "fila", "ch": ch, "fila": _legacy_fila(rec)}
+                    else:
+                        skipped.append(f"queues.{ch}")
+            elif key.startswith("ranking_"):
+                chunk = {}
+                for uid in s.keys():
+                    chunk[uid] = s.value()
+                    if len(chunk) >= RANK_CHUNK:
+                        yield {"t": "rank", "board": key, "counts": chunk}
+                        chunk = {}
+                if chunk:
+                    yield {"t": "rank", "board": key, "counts": chunk}
+            elif key == "rollups":
+                for jogo in s.keys():
+                    for bucket in s.keys():
+                        # bucket "all" tem todo mundo: linhas em lotes, como no ranking
+                        rows = {}
+                        for uid in s.keys():
+                            rows[uid] = s.value()
+                            if len(rows) >= RANK_CHUNK:
+                                yield {"t": "rollup", "jogo": jogo, "bucket": bucket, "rows": rows}
+                                rows = {}
+                        yield {"t": "rollup", "jogo": jogo, "bucket": bucket, "rows": rows}
+            elif key == "seq":
+                yield {"t": "meta", "seq": s.value()}
+            else:
+                rec = s.value()
+                if key.isdigit() and isinstance(rec, dict):
+                    yield {"t": "fila", "ch": key, "fila": _legacy_fila(rec)}
+                else:
+                    skipped.append(key)
+
+
+def read_state(path: str):
+    """(estado, seq) de um arquivo no formato compacto ou em qualquer layout JSON."""
+    if is_compact(path):
+        with open(path, "rb") as f:
+            return state_from_records(read_records(f))
+    return state_from_records(legacy_records(path))
+
+
+def replay_journal(d: dict, seq: int, path: str):
+    """Reaplica em `d` os ops do journal posteriores a `seq`.
+
+    Devolve (seq, reaplicados, bytes válidos). Só a última linha pode estar
+    cortada (crash no meio da escrita) e fica fora dos bytes válidos. Qualquer
+    outra linha ilegível ou op que não aplica levanta ValueError: seguir sem
+    ela perderia operações já confirmadas.
+    """
+    replayed = 0
+    good = 0
+    with open(path, "rb") as f:
+        for n, raw in enumerate(f, 1):
+            try:
+                op = json.loads(raw)
+            except ValueError:
+                if not raw.endswith(b"\n"):
+                    break
+                raise ValueError(f"{path}: linha {n} ilegível")
+            good += len(raw)
+            if op["seq"] <= seq:
+                continue
+            try:
+                apply_op(d, op)
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{path}: op {op['seq']} não pôde ser reaplicado ({e!r})")
+            seq = op["seq"]
+            replayed += 1
+    return seq, replayed, good
+
+
+def merged_records(sources, stats: dict):
+    """Registros de todos os `sources`, na ordem; se dois têm o mesmo canal, vale o primeiro.
+
+    Um source com `<source>.journal` (modo journal) entra com o journal já
+    reaplicado em cima do snapshot.
+    """
+    seen = set()
+    stats.setdefault("filas", 0)
+    stats.setdefault("rank", 0)
+    stats.setdefault("journal", 0)
+    stats.setdefault("skipped", [])
+    for src in sources:
+        if os.path.exists(src + ".journal"):
+            f = None
+            if is_compact(src):
+                with open(src, "rb") as snap:
+                    d, seq = state_from_records(read_records(snap))
+            else:
+                d, seq = state_from_records(legacy_records(src, stats["skipped"]))
+            seq, replayed, _ = replay_journal(d, seq, src + ".journal")
+            stats["journal"] += replayed
+            recs = state_records(d, seq)
+        elif is_compact(src):
+            f = open(src, "rb")
+            recs = read_records(f)
+        else:
+            f = None
+            recs = legacy_records(src, stats["skipped"])
+        try:
+            for rec in recs:
+                if rec["t"] == "fila":
+                    if rec["ch"] in seen:
+                        continue
+                    seen.add(rec["ch"])
+                    stats["filas"] += 1
+                elif rec["t"] == "rank":
+                    stats["rank"] += len(rec["counts"])
+                yield rec
+        finally:
+            if f is not None:
+                f.close()
+
+
+def migrate(sources, dst: str) -> dict:
+    """Converte os arquivos `sources` para o formato compacto em `dst`, registro a registro."""
+    stats = {}
+    tmp = dst + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            stats["bytes"] = write_records(f, merged_records(sources, stats))
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, dst)
+    return stats
+
+
+# ========== SQLITE ==========
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id TEXT PRIMARY KEY,
+    jogo TEXT NOT NULL,
+    valor REAL NOT NULL,
+    rodadas INTEGER NOT NULL DEFAULT 1,
+    message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS queues (
+    channel_id TEXT NOT NULL REFERENCES channels(channel_id) ON DELETE CASCADE,
+    map_key TEXT NOT NULL,
+    label TEXT NOT NULL,
+    max_pessoas INTEGER NOT NULL,
+    message_id INTEGER,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, map_key)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id TEXT NOT NULL,
+    map_key TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    UNIQUE (channel_id, map_key, user_id),
+    FOREIGN KEY (channel_id, map_key) REFERENCES queues(channel_id, map_key) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS entries_user ON entries(user_id);
+CREATE TABLE IF NOT EXISTS rankings (
+    board TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (board, user_id)
+);
+-- o top sai do Leaderboard em memória; o índice antigo só custava escrita
+DROP INDEX IF EXISTS rankings_top;
+CREATE TABLE IF NOT EXISTS rollups (
+    jogo TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    entradas INTEGER NOT NULL DEFAULT 0,
+    partidas INTEGER NOT NULL DEFAULT 0,
+    apostado REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (jogo, user_id, bucket)
+) WITHOUT ROWID;
+-- modo "shared": o que cada commit mexeu, para os outros processos relerem só isso
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    k1 TEXT NOT NULL,
+    k2 TEXT NOT NULL DEFAULT ''
+);
+"""
+
+# linhas de `changes` mantidas; um processo mais atrasado que isso relê tudo
+CHANGES_KEEP = 10000
+
+
+class StoreBusy(Exception):
+    """Outro processo segurou o lock de escrita além do busy timeout."""
+
+
+class SqliteBackend:
+    """Espelha cada op em linhas de tabela (SQLite em modo WAL).
+
+    Um join vira um único INSERT em `entries` e o ranking é um upsert em
+    `rankings`, em vez de regravar o blob inteiro.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0, log_changes: bool = False):
+        self.path = path
+        self.log_changes = log_changes
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def is_empty(self) -> bool:
+        row = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM channels) + (SELECT COUNT(*) FROM rankings)"
+        ).fetchone()
+        return row[0] == 0
+
+    def load_channel(self, ch: str):
+        """Registro da fila de um canal lido do banco, ou None se não existe."""
+        c = self.conn
+        row = c.execute("SELECT jogo, valor, rodadas, message_id FROM channels WHERE channel_id = ?", (ch,)).fetchone()
+        if row is None:
+            return None
+        fila = {"jogo": row[0], "valor": row[1], "rodadas": row[2], "queues": {}, "message_id": row[3]}
+        for k, label, max_p, mid in c.execute(
+                "SELECT map_key, label, max_pessoas, message_id FROM queues WHERE channel_id = ? ORDER BY position", (ch,)):
+            fila["queues"][k] = {"label": label, "inscritos": Roster(), "max_pessoas": max_p, "message_id": mid}
+        for k, uid in c.execute("SELECT map_key, user_id FROM entries WHERE channel_id = ? ORDER BY seq", (ch,)):
+            fila["queues"][k]["inscritos"].add(uid)
+        return fila
+
+    def queues_of(self, uid: str) -> set:
+        return set(self.conn.execute("SELECT channel_id, map_key FROM entries WHERE user_id = ?", (uid,)))
+
+    def last_change(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, last: int):
+        """Linhas (id, kind, k1, k2) de `changes` depois de `last`; None se já foram podadas."""
+        rows = self.conn.execute("SELECT id, kind, k1, k2 FROM changes WHERE id > ? ORDER BY id", (last,)).fetchall()
+        if rows and rows[0][0] != last + 1:
+            return None
+        return rows
+
+    def trim_changes(self, upto: int):
+        self.conn.execute("DELETE FROM changes WHERE id <= ?", (upto,))
+
+    def ranking_count(self, board: str, uid: str) -> int:
+        row = self.conn.execute("SELECT count FROM rankings WHERE board = ? AND user_id = ?", (board, uid)).fetchone()
+        return row[0] if row else 0
+
+    def rollups_of(self, jogo: str, uid: str = None) -> dict:
+        """{bucket: {uid: [entradas, partidas, apostado]}} do jogo (só de `uid`, se dado)."""
+        sql = "SELECT bucket, user_id, entradas, partidas, apostado FROM rollups WHERE jogo = ?"
+        args = (jogo,)
+        if uid is not None:
+            sql += " AND user_id = ?"
+            args += (uid,)
+        out = {}
+        for bucket, u, entradas, partidas, apostado in self.conn.execute(sql, args):
+            out.setdefault(bucket, {})[u] = [entradas, partidas, apostado]
+        return out
+
+    def _changed(self, kind: str, k1: str, k2: str = ""):
+        if self.log_changes:
+            self.conn.execute("INSERT INTO changes (kind, k1, k2) VALUES (?, ?, ?)", (kind, k1, k2))
+
+    def load(self) -> dict:
+        d = json.loads(json.dumps(BASE_DATA))
+        c = self.conn
+        for ch, jogo, valor, rodadas, mid in c.execute(
+                "SELECT channel_id, jogo, valor, rodadas, message_id FROM channels"):
+            d["filas"][ch] = {"jogo": jogo, "valor": valor, "rodadas": rodadas, "queues": {}, "message_id": mid}
+        for ch, k, label, max_p, mid in c.execute(
+                "SELECT channel_id, map_key, label, max_pessoas, message_id FROM queues ORDER BY channel_id, position"):
+            d["filas"][ch]["queues"][k] = {"label": label, "inscritos": Roster(), "max_pessoas": max_p, "message_id": mid}
+        for ch, k, uid in c.execute("SELECT channel_id, map_key, user_id FROM entries ORDER BY seq"):
+            d["filas"][ch]["queues"][k]["inscritos"].add(uid)
+        for board, uid, count in c.execute("SELECT board, user_id, count FROM rankings"):
+            d.setdefault(board, {})[uid] = count
+        for jogo, bucket, uid, entradas, partidas, apostado in c.execute(
+                "SELECT jogo, bucket, user_id, entradas, partidas, apostado FROM rollups"):
+            d["rollups"].setdefault(jogo, {}).setdefault(bucket, {})[uid] = [entradas, partidas, apostado]
+        return d
+
+    def apply(self, d: dict, op: dict, fresh=()):
+        """Grava `op` (já aplicado em `d`) numa transação (ou na que já está aberta).
+
+        `fresh` são os buckets de período que o op abriu; só eles disparam a
+        limpeza dos rollups expirados.
+        """
+        c = self.conn
+        kind = op["op"]
+        own = not c.in_transaction
+        if own:
+            c.execute("BEGIN")
+        try:
+            if kind == "setup":
+                fila = d["filas"][op["ch"]]
+                c.execute(
+                    "INSERT INTO channels (channel_id, jogo, valor, rodadas) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(channel_id) DO UPDATE SET jogo = excluded.jogo, valor = excluded.valor",
+                    (op["ch"], fila["jogo"], fila["valor"], fila["rodadas"]))
+                keys = list(fila["queues"])
+                for k, label in op["queues"]:
+                    c.execute(
+                        "INSERT INTO queues (channel_id, map_key, label, max_pessoas, position) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(channel_id, map_key) DO UPDATE SET max_pessoas = excluded.max_pessoas",
+                        (op["ch"], k, label, op["max_pessoas"], keys.index(k)))
+            elif kind == "message":
+                c.execute("UPDATE channels SET message_id = ? WHERE channel_id = ?", (op["mid"], op["ch"]))
+            elif kind == "remove":
+                c.execute("DELETE FROM channels WHERE channel_id = ?", (op["ch"],))
+            elif kind == "join":
+                c.execute("INSERT OR IGNORE INTO entries (channel_id, map_key, user_id) VALUES (?, ?, ?)",
+                          (op["ch"], op["q"], op["uid"]))
+            elif kind == "leave":
+                c.execute("DELETE FROM entries WHERE channel_id = ? AND map_key = ? AND user_id = ?",
+                          (op["ch"], op["q"], op["uid"]))
+            elif kind == "reset":
+                c.execute("DELETE FROM entries WHERE channel_id = ? AND map_key = ?", (op["ch"], op["q"]))
+                c.execute("UPDATE channels SET rodadas = rodadas + 1 WHERE channel_id = ?", (op["ch"],))
+            elif kind == "rank":
+                c.execute(
+                    "INSERT INTO rankings (board, user_id, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT(board, user_id) DO UPDATE SET count = count + 1",
+                    (ranking_key(op["jogo"]), op["uid"]))
+                self._rollup(d, op["jogo"], op.get("buckets", ()), (op["uid"],), 1, 0, 0.0, fresh)
+                self._changed("rank", op["jogo"], op["uid"])
+            elif kind == "match":
+                self._rollup(d, op["jogo"], op.get("buckets", ()), op["uids"], 0, 1,
+                             float(op["valor"]) + float(op.get("taxa", 0)), fresh)
+                for uid in op["uids"]:
+                    self._changed("rank", op["jogo"], uid)
+            if "ch" in op:
+                self._changed("ch", op["ch"])
+            if own:
+                c.execute("COMMIT")
+        except Exception:
+            if own:
+                c.execute("ROLLBACK")
+            raise
+
+    def _rollup(self, d: dict, jogo: str, buckets, uids, entradas, partidas, apostado, fresh=()):
+        c = self.conn
+        for b in buckets:
+            c.executemany(
+                "INSERT INTO rollups (jogo, bucket, user_id, entradas, partidas, apostado) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(jogo, user_id, bucket) DO UPDATE SET entradas = entradas + excluded.entradas, "
+                "partidas = partidas + excluded.partidas, apostado = apostado + excluded.apostado",
+                [(jogo, b, uid, entradas, partidas, apostado) for uid in uids])
+        # mesma retenção que apply_op já aplicou em `d`, que só poda ao abrir um bucket
+        by_bucket = d.get("rollups", {}).get(jogo, {})
+        for kind in {b.split(":", 1)[0] for b in fresh if ":" in b}:
+            cutoff = rollup_cutoff(by_bucket, kind)
+            if cutoff is not None:
+                cur = c.execute("DELETE FROM rollups WHERE jogo = ? AND bucket >= ? AND bucket < ?",
+                                (jogo, kind + ":", cutoff))
+                if cur.rowcount:
+                    self._changed("rollups", jogo)
+
+    def import_data(self, d: dict):
+        """Substitui o conteúdo do banco pelo layout de dados.json."""
+        c = self.conn
+        c.execute("BEGIN")
+        try:
+            c.execute("DELETE FROM channels")
+            c.execute("DELETE FROM rankings")
+            c.execute("DELETE FROM rollups")
+            for ch, fila in d.get("filas", {}).items():
+                c.execute(
+                    "INSERT INTO channels (channel_id, jogo, valor, rodadas, message_id) VALUES (?, ?, ?, ?, ?)",
+                    (ch, fila.get("jogo", "stumble"), float(fila.get("valor", 1.0)),
+                     fila.get("rodadas", 1), fila.get("message_id")))
+                for pos, (k, q) in enumerate(fila.get("queues", {}).items()):
+                    c.execute(
+                        "INSERT INTO queues (channel_id, map_key, label, max_pessoas, message_id, position) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (ch, k, q["label"], q["max_pessoas"], q.get("message_id"), pos))
+                    c.executemany("INSERT OR IGNORE INTO entries (channel_id, map_key, user_id) VALUES (?, ?, ?)",
+                                  [(ch, k, uid) for uid in q.get("inscritos", [])])
+            for board, rk in d.items():
+                if board.startswith("ranking_"):
+                    c.executemany("INSERT INTO rankings (board, user_id, count) VALUES (?, ?, ?)",
+                                  [(board, uid, n) for uid, n in rk.items()])
+            for jogo, by_bucket in d.get("rollups", {}).items():
+                for bucket, rows in by_bucket.items():
+                    c.executemany(
+                        "INSERT INTO rollups (jogo, bucket, user_id, entradas, partidas, apostado) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(jogo, bucket, uid, *row) for uid, row in rows.items()])
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+def import_json_to_sqlite(json_path: str, db_path: str):
+    """Importa um arquivo de estado (compacto ou qualquer layout JSON) para o banco SQLite."""
+    d, _ = read_state(json_path)
+    backend = SqliteBackend(db_path)
+    try:
+        backend.import_data(d)
+    finally:
+        backend.close()
+
+
+# ========== STORE ==========
+class Store:
+    """Estado autoritativo em memória com persistência em background.
+
+    O arquivo é lido uma única vez em load(); depois disso os handlers só
+    mexem no estado via commit(op). Dois modos:
+
+    - "json": o snapshot inteiro é regravado pelo flusher a cada
+      `flush_interval` segundos ou quando `flush_batch` ops se acumulam.
+    - "journal": cada op é anexado como uma linha em `<path>.journal`
+      (O(1) bytes por mutação); a cada `compact_every` ops o flusher grava
+      um snapshot novo (tmp + rename atômico) e encurta o journal. No boot o
+      snapshot é lido e o journal é reaplicado por cima.
+    - "sqlite": cada op é gravado como linhas no banco `db_path` (WAL); o
+      JSON só é usado para a importação inicial se o banco estiver vazio.
+    Nos modos de arquivo, `fmt` escolhe o snapshot: "compact" (ver FORMATO
+    COMPACTO) ou "json" (indentado, como o dados.json antigo). Se `path` não
+    existe, os arquivos de `legacy` que existirem são migrados para ele.
+
+    - "shared": o mesmo banco, dividido entre vários processos (shards). As
+      seções críticas rodam em transaction(), que pega o lock de escrita do
+      SQLite (BEGIN IMMEDIATE) e relê o canal antes da checagem; esperar
+      mais que `busy_timeout` pelo lock levanta StoreBusy. A cada
+      `flush_interval` segundos o flusher relê só o que a tabela `changes`
+      diz que os outros processos mexeram.
+    """
+
+    def __init__(self, path: str, mode: str = "json", flush_interval: float = 2.0,
+                 flush_batch: int = 50, compact_every: int = 1000, fsync: bool = True,
+                 db_path: str = "dados.db", fmt: str = "json", legacy=(), busy_timeout: float = 0.5):
+        if mode not in ("json", "journal", "sqlite", "shared"):
+            raise ValueError(f"modo de armazenamento inválido: {mode}")
+        if fmt not in ("json", "compact"):
+            raise ValueError(f"formato de arquivo inválido: {fmt}")
+        self.path = path
+        self.mode = mode
+        self.fmt = fmt
+        self.legacy = list(legacy)
+        self.journal_path = path + ".journal"
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.db = None
+        self._cursor = 0  # último id de `changes` já relido (modo "shared")
+        self._trimmed = 0
+        self.data = None
+        self.boards = {}  # "ranking_<jogo>" -> Leaderboard
+        self.periods = {}  # (jogo, bucket) -> Leaderboard de entradas no período
+        self.members = MemberIndex()
+        self.dirty = 0
+        self.seq = 0  # número do último op aplicado
+        self._journal = None
+        self._tail = None  # linhas escritas durante uma compactação
+        self._wakeup = None
+
+    # ---- carga ----
+    def load(self) -> dict:
+        t = time.perf_counter()
+        if not os.path.exists(self.path):
+            self._migrate_legacy()
+        if self.mode in ("sqlite", "shared"):
+            self.db = SqliteBackend(self.db_path, timeout=self.busy_timeout, log_changes=self.mode == "shared")
+            if self.db.is_empty() and os.path.exists(self.path):
+                import_json_to_sqlite(self.path, self.db_path)
+                print(f"{self.path} importado para {self.db_path}.")
+            # cursor antes da leitura: o que entrar no meio é relido depois
+            self._cursor = self._trimmed = self.db.last_change()
+            self.data = self.db.load()
+        else:
+            self._load_file()
+        self.boards = {k: Leaderboard(v) for k, v in self.data.items() if k.startswith("ranking_")}
+        self.periods = {}
+        for jogo in self.data["rollups"]:
+            self._sync_periods(jogo)
+        self.members.rebuild(self.data)
+        metrics.STORE_LOAD_SECONDS.set(time.perf_counter() - t)
+        return self.data
+
+    def _migrate_legacy(self):
+        sources = [p for p in self.legacy if os.path.exists(p)]
+        if not sources:
+            return
+        try:
+            if self.fmt == "compact":
+                stats = migrate(sources, self.path)
+            else:
+                stats = {}
+                self.data, self.seq = state_from_records(merged_records(sources, stats))
+                self._write(self._dump())
+        except ValueError as e:
+            raise RuntimeError(f"Migração para {self.path} cancelada, nada foi gravado: {e}") from e
+        print(f"{', '.join(sources)} migrado(s) para {self.path}: {stats['filas']} filas, "
+              f"{stats['rank']} entradas de ranking, {stats['journal']} ops do journal.")
+        if stats["skipped"]:
+            print(f"Registros antigos sem canal ignorados: {', '.join(stats['skipped'])}")
+
+    def _load_file(self):
+        if not os.path.exists(self.path):
+            self.data = json.loads(json.dumps(BASE_DATA))
+            self._write(self._dump())
+            self.seq = 0
+        elif is_compact(self.path):
+            self.data, self.seq = read_state(self.path)
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = hydrate(json.load(f))
+            self.seq = self.data.pop("seq", 0)
+        for k, v in BASE_DATA.items():
+            self.data.setdefault(k, type(v)())
+        self.dirty = 0
+        if self.mode == "journal":
+            self._replay()
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        try:
+            self.seq, replayed, good = replay_journal(self.data, self.seq, self.journal_path)
+        except ValueError as e:
+            # corrupção no meio do journal: não sobe em vez de cortar ops confirmados
+            raise RuntimeError(f"Journal corrompido, o estado não foi carregado: {e}") from e
+        if good != os.path.getsize(self.journal_path):
+            # última linha cortada por um crash: tira do arquivo antes de anexar
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good)
+        self.dirty = replayed
+        if replayed:
+            print(f"Journal: {replayed} operações reaplicadas.")
+
+    # ---- escrita ----
+    def commit(self, op: dict):
+        """Aplica o op no estado em memória e registra para persistência."""
+        t = time.perf_counter()
+        try:
+            self._commit(op)
+        finally:
+            metrics.STORE_COMMIT_SECONDS.labels(self.mode).observe(time.perf_counter() - t)
+
+    def _commit(self, op: dict):
+        self.members.update(self.data, op)
+        fresh = ()
+        if op["op"] in ("rank", "match"):
+            fresh = [b for b in op.get("buckets", ()) if (op["jogo"], b) not in self.periods]
+        apply_op(self.data, op)
+        if fresh:
+            # bucket novo: cria o índice dele e solta os que expiraram
+            self._sync_periods(op["jogo"])
+        if op["op"] == "rank":
+            key = ranking_key(op["jogo"])
+            self.boards.setdefault(key, Leaderboard()).incr(op["uid"])
+            for b in op.get("buckets", ()):
+                if b not in fresh:
+                    self.periods[(op["jogo"], b)].incr(op["uid"])
+        if self.db is not None:
+            self.db.apply(self.data, op, fresh)
+            return
+        self.seq += 1
+        if self.mode == "journal":
+            op = dict(op, seq=self.seq)
+            line = json.dumps(op, separators=(",", ":"), ensure_ascii=False) + "\n"
+            self._journal.write(line)
+            metrics.STORE_WRITE_BYTES.labels("journal").inc(len(line.encode("utf-8")))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            if self._tail is not None:
+                self._tail.append(line)
+        self.dirty += 1
+        threshold = self.compact_every if self.mode == "journal" else self.flush_batch
+        if self.dirty >= threshold and self._wakeup is not None:
+            self._wakeup.set()
+
+    @contextmanager
+    def transaction(self, ch: str = None):
+        """Seção atômica entre processos (modo "shared"); nos outros modos não faz nada.
+
+        Dentro dela o canal `ch` está igual ao banco e nenhum outro processo
+        grava até o fim. Não pode ter await dentro: o lock é do SQLite.
+        """
+        if self.mode != "shared":
+            yield
+            return
+        try:
+            self.db.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise StoreBusy(str(e)) from e
+            raise
+        try:
+            if ch is not None:
+                self.refresh_channel(ch)
+            yield
+        except BaseException:
+            self.db.conn.execute("ROLLBACK")
+            if ch is not None:
+                self.refresh_channel(ch)  # desfaz na memória o que não foi gravado
+            raise
+        else:
+            self.db.conn.execute("COMMIT")
+
+    def _sync_periods(self, jogo: str):
+        by_bucket = self.data["rollups"].get(jogo, {})
+        for key in [k for k in self.periods if k[0] == jogo and k[1] not in by_bucket]:
+            del self.periods[key]
+        for bucket, rows in by_bucket.items():
+            counts = {uid: row[0] for uid, row in rows.items() if row[0]}
+            board = self.periods.get((jogo, bucket))
+            if board is None:
+                self.periods[(jogo, bucket)] = Leaderboard(counts)
+            else:
+                board.replace(counts)
+
+    def period_board(self, jogo: str, bucket: str) -> "Leaderboard":
+        """Ranking de entradas de um bucket de período (vazio se não há dados)."""
+        return self.periods.get((jogo, bucket)) or Leaderboard()
+
+    def period_stats(self, jogo: str, bucket: str, uid: str):
+        """[entradas, partidas, apostado] do usuário no bucket."""
+        return self.data["rollups"].get(jogo, {}).get(bucket, {}).get(uid, [0, 0, 0.0])
+
+    def refresh_channel(self, ch: str):
+        """Relê do banco a fila do canal `ch` (modo "shared")."""
+        self.members.drop_channel(self.data, ch)
+        fila = self.db.load_channel(ch)
+        if fila is None:
+            self.data["filas"].pop(ch, None)
+        else:
+            self.data["filas"][ch] = fila
+            self.members.add_channel(self.data, ch)
+
+    def refresh(self):
+        """Traz o que os outros processos gravaram desde a última leitura (modo "shared").
+
+        Só relê as linhas que `changes` aponta; se o log já foi podado além
+        do cursor deste processo, cai na releitura completa.
+        """
+        changes = self.db.changes_since(self._cursor)
+        if changes is None:
+            return self.reload()
+        if not changes:
+            return
+        chans, users, jogos = set(), set(), set()
+        for _, kind, k1, k2 in changes:
+            if kind == "ch":
+                chans.add(k1)
+            elif kind == "rank":
+                users.add((k1, k2))
+            elif kind == "rollups":
+                jogos.add(k1)
+        for ch in chans:
+            self.refresh_channel(ch)
+        for jogo, uid in users:
+            self._refresh_user(jogo, uid, jogo not in jogos)
+        for jogo in jogos:
+            self.data["rollups"][jogo] = self.db.rollups_of(jogo)
+            self._sync_periods(jogo)
+        self._cursor = changes[-1][0]
+        if self._cursor - self._trimmed >= 2 * CHANGES_KEEP:
+            self.db.trim_changes(self._cursor - CHANGES_KEEP)
+            self._trimmed = self._cursor - CHANGES_KEEP
+
+    def _refresh_user(self, jogo: str, uid: str, rollups: bool):
+        key = ranking_key(jogo)
+        count = self.db.ranking_count(key, uid)
+        rk = self.data.setdefault(key, {})
+        if count != rk.get(uid, 0):
+            self.board(key).incr(uid, count - rk.get(uid, 0))
+            rk[uid] = count
+        if not rollups:
+            return
+        by_bucket = self.data["rollups"].setdefault(jogo, {})
+        new_bucket = False
+        for bucket, rows in self.db.rollups_of(jogo, uid).items():
+            row = rows[uid]
+            old = by_bucket.setdefault(bucket, {}).get(uid, [0, 0, 0.0])
+            by_bucket[bucket][uid] = row
+            board = self.periods.get((jogo, bucket))
+            if board is None:
+                new_bucket = True
+            elif row[0] != old[0]:
+                board.incr(uid, row[0] - old[0])
+        if new_bucket:
+            self._sync_periods(jogo)
+
+    def reload(self):
+        """Relê todo o estado do banco (modo "shared")."""
+        self._cursor = self.db.last_change()
+        self.data = self.db.load()
+        for k, v in self.data.items():
+            if k.startswith("ranking_"):
+                self.board(k).replace(v)
+        for jogo in set(self.data["rollups"]) | {k[0] for k in self.periods}:
+            self._sync_periods(jogo)
+        self.members.rebuild(self.data)
+
+    def queues_of(self, uid: str) -> set:
+        """Filas {(channel_id, map_key)} em que o usuário está inscrito."""
+        if self.mode == "shared":
+            # outros processos também inscrevem: a fonte é o banco
+            return self.db.queues_of(uid)
+        return self.members.queues_of(uid)
+
+    def board(self, key: str) -> "Leaderboard":
+        """Índice de ranking mantido incrementalmente (ver Leaderboard)."""
+        b = self.boards.get(key)
+        if b is None:
+            b = self.boards[key] = Leaderboard()
+        return b
+
+    def _dump(self) -> bytes:
+        if self.fmt == "compact":
+            buf = io.BytesIO()
+            write_records(buf, state_records(self.data, self.seq))
+            return buf.getvalue()
+        d = self.data
+        if self.mode == "journal":
+            d = dict(d, seq=self.seq)
+        return json.dumps(d, indent=4, ensure_ascii=False, default=list).encode("utf-8")
+
+    def _write(self, raw: bytes):
+        t = time.perf_counter()
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        metrics.STORE_WRITE_SECONDS.labels("snapshot").observe(time.perf_counter() - t)
+        metrics.STORE_WRITE_BYTES.labels("snapshot").inc(len(raw))
+
+    def _reset_journal(self, lines):
+        """Troca o journal por um contendo só `lines` (ops após o snapshot)."""
+        self._journal.close()
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def flush(self):
+        """Grava imediatamente (síncrono). Usado no desligamento."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            return
+        if self.dirty:
+            self.dirty = 0
+            self._write(self._dump())
+            if self.mode == "journal":
+                self._reset_journal([])
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    async def run_flusher(self):
+        self._wakeup = asyncio.Event()
+        if self.mode == "shared":
+            # nada a gravar (cada op já vai ao banco); só acompanha os outros processos
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    self.refresh()
+                except sqlite3.Error as e:
+                    print("Erro ao reler estado compartilhado:", e)
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.dirty:
+                continue
+            if self.mode == "journal" and self.dirty < self.compact_every:
+                continue  # o journal já garante a durabilidade
+            # serializa no loop (estado só é mutado aqui) e grava numa thread
+            pending = self.dirty
+            self.dirty = 0
+            raw = self._dump()
+            if self.mode == "journal":
+                self._tail = []
+            write = asyncio.ensure_future(asyncio.to_thread(self._write, raw))
+            cancelled = False
+            while not write.done():
+                try:
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # desligando: a gravação em curso termina antes de sair,
+                    # senão ela e o flush final escrevem o mesmo .tmp
+                    cancelled = True
+                except Exception:
+                    pass
+            if write.exception() is not None:
+                print("Erro ao salvar dados:", write.exception())
+                self.dirty += pending
+                self._tail = None
+            elif self.mode == "journal":
+                tail, self._tail = self._tail, None
+                self._reset_journal(tail)
+            if cancelled:
+                raise asyncio.CancelledError
+
+
+if __name__ == "__main__":
+    # uso: python storage.py import-sqlite [dados.json] [dados.db]
+    #      python storage.py migrate [destino.fila] [origem ...]
+    if len(sys.argv) >= 2 and sys.argv[1] == "import-sqlite":
+        src = sys.argv[2] if len(sys.argv) > 2 else "dados.json"
+        dst = sys.argv[3] if len(sys.argv) > 3 else "dados.db"
+        import_json_to_sqlite(src, dst)
+        print(f"{src} importado para {dst}.")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        dst = sys.argv[2] if len(sys.argv) > 2 else "dados.fila"
+        srcs = sys.argv[3:] or [p for p in ("dados.json", "filas.json", "db.json") if os.path.exists(p)]
+        stats = migrate(srcs, dst)
+        print(f"{', '.join(srcs)} -> {dst}: {stats['filas']} filas, {stats['rank']} entradas de ranking, "
+              f"{stats['journal']} ops do journal, {stats['bytes']} bytes.")
+        if stats["skipped"]:
+            print(f"ignorados (sem canal): {', '.join(stats['skipped'])}")
+    else:
+        print("uso: python storage.py import-sqlite [dados.json] [dados.db]\n"
+              "     python storage.py migrate [destino.fila] [origem ...]")